@@ -0,0 +1,312 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" Benchmarks pyhorn against an in-process mock Bullhorn server.
+
+    python benchmarks/bench.py --latency 0.02 --output results.json
+
+    Every scenario goes through the real `pyhorn.auth.Credentials` and
+    `pyhorn.client.RESTClient` and reports operations and requests per
+    second, p50/p99 request latency, peak traced memory and the number of
+    logins it took. Results are printed (or written to --output) as JSON so
+    runs of different versions can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyhorn.auth  # noqa: E402
+import pyhorn.client  # noqa: E402
+import pyhorn.events  # noqa: E402
+import pyhorn.hedging  # noqa: E402
+import pyhorn.metrics  # noqa: E402
+from mock_server import MockBullhorn  # noqa: E402
+
+
+def _version():
+    try:
+        from importlib.metadata import version
+        return version("pyhorn-flow")
+    except Exception:
+        return "unknown"
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * len(ordered))))]
+
+
+def get_entity(client, server, args):
+    ids = [random.randint(1, args.records) for _ in range(args.requests)]
+
+    def timed(entity_id):
+        started = time.perf_counter()
+        client.get_entity("Candidate", entity_id, fields="id,name")
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        call_latencies = list(executor.map(timed, ids))
+    return len(ids), call_latencies
+
+
+def entity_loader(client, server, args):
+    ids = [random.randint(1, args.records) for _ in range(args.requests)]
+    with client.entity_loader() as loader, \
+            ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(
+            executor.map(
+                lambda i: loader.load("Candidate", i, fields="id,name"),
+                ids))
+    return len(ids)
+
+
+def get_entity_hedged(client, server, args):
+    client.hedger = pyhorn.hedging.Hedger()
+    try:
+        return get_entity(client, server, args)
+    finally:
+        client.hedger.close()
+        client.hedger = None
+
+
+def get_entity_reauth(client, server, args):
+    server.session_ttl = args.session_ttl
+    server.expire_sessions()
+    try:
+        return get_entity(client, server, args)
+    finally:
+        server.session_ttl = 600.0
+
+
+def query_offset(client, server, args):
+    return sum(1 for _ in client.iter_query(
+        "Candidate", "id>0", fields="id,name", page_size=args.page_size))
+
+
+def query_keyset(client, server, args):
+    return sum(1 for _ in client.iter_query("Candidate",
+                                            "id>0",
+                                            fields="id,name",
+                                            page_size=args.page_size,
+                                            keyset=True))
+
+
+def search_keyset(client, server, args):
+    return sum(1 for _ in client.iter_search("Candidate",
+                                             "isDeleted:0",
+                                             fields="id,name",
+                                             page_size=args.page_size,
+                                             keyset=True))
+
+
+def scan(client, server, args):
+    return sum(1 for _ in client.scan("Candidate",
+                                      "id>0",
+                                      "id,name",
+                                      workers=args.threads,
+                                      page_size=args.page_size))
+
+
+def bulk_write(client, server, args):
+    operations = (("update", "Candidate", {
+        "id": random.randint(1, args.records),
+        "status": "Active"
+    }) for _ in range(args.requests))
+    results = list(client.bulk_write(operations, concurrency=args.threads))
+    failed = [r for r in results if r.error is not None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} bulk writes failed")
+    return len(results)
+
+
+def event_capture(client, server, args):
+    server.pending_events = args.events
+    handled = []
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint = pyhorn.events.FileCheckpoint(
+            os.path.join(directory, "checkpoint.json"))
+        consumer = pyhorn.events.EventConsumer(
+            client,
+            "bench",
+            lambda sub_id, events: handled.append(len(events)),
+            checkpoint,
+            workers=args.threads,
+            max_events=500,
+            poll_interval=0.01)
+        with consumer:
+            while sum(handled) < args.events and not consumer.errors:
+                time.sleep(0.005)
+    return sum(handled)
+
+
+def file_download(client, server, args):
+    entity_ids = range(1, max(1, args.requests // server.files_per_record) + 1)
+    with tempfile.TemporaryDirectory() as directory:
+        results = list(
+            client.download_attachments("Candidate",
+                                        entity_ids,
+                                        directory,
+                                        workers=args.threads))
+    failed = [r for r in results if r.error is not None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} downloads failed")
+    return len(results)
+
+
+SCENARIOS = {
+    "get_entity": get_entity,
+    "entity_loader": entity_loader,
+    "get_entity_hedged": get_entity_hedged,
+    "get_entity_reauth": get_entity_reauth,
+    "query_offset": query_offset,
+    "query_keyset": query_keyset,
+    "search_keyset": search_keyset,
+    "scan": scan,
+    "bulk_write": bulk_write,
+    "event_capture": event_capture,
+    "file_download": file_download,
+}
+
+
+def run(name, client, server, args) -> dict:
+    latencies = []
+    metrics = pyhorn.metrics.Metrics()
+    metrics.add_hook(lambda event: latencies.append(event.elapsed))
+    client.metrics = metrics
+    before = dict(server.counters)
+
+    if args.memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    operations = SCENARIOS[name](client, server, args)
+    call_latencies = None
+    if isinstance(operations, tuple):
+        operations, call_latencies = operations
+    elapsed = time.perf_counter() - started
+    peak = None
+    if args.memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    client.metrics = None
+
+    requests = server.counters["requests"] - before["requests"]
+    counters = metrics.snapshot()["counters"]
+    return {
+        "operations": operations,
+        "requests": requests,
+        "seconds": elapsed,
+        "operations_per_second": operations / elapsed,
+        "requests_per_second": requests / elapsed,
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p99": _percentile(latencies, 99),
+        "call_latency_p99": _percentile(call_latencies, 99),
+        "latency_mean":
+        statistics.fmean(latencies) if latencies else None,
+        "peak_memory_bytes": peak,
+        "logins": server.counters["logins"] - before["logins"],
+        "unauthorized": server.counters["unauthorized"] -
+        before["unauthorized"],
+        "throttled": server.counters["throttled"] - before["throttled"],
+        "client_retries": counters.get("retries", 0),
+        "client_reauths": counters.get("reauths", 0),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenarios",
+                        default=",".join(SCENARIOS),
+                        help="comma separated scenarios to run")
+    parser.add_argument("--records", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--tail-fraction", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=1.0)
+    parser.add_argument("--max-page-size", type=int, default=500)
+    parser.add_argument("--session-ttl",
+                        type=float,
+                        default=0.5,
+                        help="session lifetime in get_entity_reauth")
+    parser.add_argument("--rate-limit", type=int, default=None)
+    parser.add_argument("--memory",
+                        action=argparse.BooleanOptionalAction,
+                        default=True,
+                        help="trace peak memory (slows every scenario)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    server = MockBullhorn(records=args.records,
+                          latency=args.latency,
+                          jitter=args.jitter,
+                          tail_fraction=args.tail_fraction,
+                          tail_latency=args.tail_latency,
+                          max_page_size=args.max_page_size,
+                          rate_limit=args.rate_limit)
+    results = {}
+    with server, tempfile.TemporaryDirectory() as directory:
+        auth_file = os.path.join(directory, "auth.json")
+        with open(auth_file, "w") as stream:
+            json.dump(server.credentials(), stream)
+        credentials = pyhorn.auth.Credentials.from_json(auth_file)
+        pool = max(10, args.threads * 2)
+        with pyhorn.client.RESTClient(credentials,
+                                      pool_maxsize=pool) as client:
+            for name in args.scenarios.split(","):
+                results[name] = run(name.strip(), client, server, args)
+                print(f"{name}: {results[name]['operations_per_second']:.0f}"
+                      " ops/s", file=sys.stderr)
+
+    report = {
+        "pyhorn_version": _version(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "config": {k: v
+                   for k, v in vars(args).items() if k != "output"},
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(report, stream, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
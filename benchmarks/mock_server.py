@@ -0,0 +1,402 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" In-process mock of the Bullhorn OAuth and REST APIs for benchmarks.
+
+    Serves the endpoints pyhorn uses (authorize, token, login, ping, entity,
+    query, search, event subscriptions) over plain HTTP, with configurable
+    latency, page size, session expiry and throttling.
+"""
+
+import gzip
+import json
+import operator
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+__all__ = ['MockBullhorn']
+
+_comparison = re.compile(r"(\w+)\s*(>=|<=|<>|>|<|=)\s*(-?\d+)")
+_byte_range = re.compile(r"bytes=(\d+)-$")
+_id_range = re.compile(r"id:\{(\d+) TO \*\}")
+_operators = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "<>": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+    "=": operator.eq
+}
+
+
+class MockBullhorn:
+    """ `latency` (seconds, plus up to `jitter`) is added to every REST call.
+        Sessions expire `session_ttl` seconds after login, answering 401 from
+        then on. With `rate_limit` set, calls beyond that many per second get
+        a 429 with a Retry-After header. A `tail_fraction` of the calls take
+        `tail_latency` seconds longer. Query and search pages are capped at
+        `max_page_size` records.
+    """
+    def __init__(self,
+                 records=10000,
+                 latency=0.0,
+                 jitter=0.0,
+                 max_page_size=500,
+                 session_ttl=600.0,
+                 rate_limit=None,
+                 events=0,
+                 tail_fraction=0.0,
+                 tail_latency=1.0,
+                 file_size=256 * 1024,
+                 files_per_record=2):
+        self.records = [{
+            "id": i,
+            "name": f"Record {i}",
+            "status": "Open" if i % 3 else "Closed",
+            "dateAdded": 1500000000000 + i * 1000,
+            "dateLastModified": 1600000000000 + i * 1000,
+            "description": "lorem ipsum " * 20
+        } for i in range(1, records + 1)]
+        self.by_id = {r["id"]: r for r in self.records}
+        self.latency = latency
+        self.jitter = jitter
+        self.max_page_size = max_page_size
+        self.session_ttl = session_ttl
+        self.rate_limit = rate_limit
+        self.pending_events = events
+        self.tail_fraction = tail_fraction
+        self.tail_latency = tail_latency
+        self.file_size = file_size
+        self.files_per_record = files_per_record
+        self.file_content = bytes(range(256)) * (file_size // 256 + 1)
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.request_id = 0
+        self.last_batch = None
+        self.window = (0, 0)
+        self.counters = {
+            "requests": 0,
+            "logins": 0,
+            "token_grants": 0,
+            "unauthorized": 0,
+            "throttled": 0,
+            "downloads": 0,
+            "uploads": 0
+        }
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def netloc(self):
+        return self.url.split("://", 1)[1]
+
+    def credentials(self) -> dict:
+        """ Credentials file contents pointing pyhorn at this server. """
+        return {
+            "client_id": "bench",
+            "client_secret": "bench",
+            "username": "bench",
+            "password": "bench",
+            "scheme": "http",
+            "auth_endpoint": self.netloc,
+            "rest_endpoint": self.netloc
+        }
+
+    def start(self):
+        handler = type("Handler", (_Handler, ), {"bullhorn": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def expire_sessions(self):
+        with self.lock:
+            self.tokens.clear()
+
+    def issue_session(self) -> str:
+        token = secrets.token_hex(8)
+        with self.lock:
+            self.tokens[token] = time.time() + self.session_ttl
+            self.counters["logins"] += 1
+        return token
+
+    def session_expires(self, token):
+        with self.lock:
+            expires = self.tokens.get(token)
+        if expires is None or expires < time.time():
+            return None
+        return expires
+
+    def throttled(self) -> bool:
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            second = int(time.time())
+            start, calls = self.window
+            if start != second:
+                start, calls = second, 0
+            self.window = (start, calls + 1)
+            if calls + 1 > self.rate_limit:
+                self.counters["throttled"] += 1
+                return True
+        return False
+
+    def select(self, clause, search=False):
+        records = self.records
+        if search:
+            match = _id_range.search(clause)
+            if match:
+                last = int(match.group(1))
+                records = [r for r in records if r["id"] > last]
+            return records
+        for field, op, value in _comparison.findall(clause):
+            compare = _operators[op]
+            records = [
+                r for r in records
+                if compare(r.get(field, 0) or 0, int(value))
+            ]
+        return records
+
+    def page(self, records, params):
+        sort = params.get("sort", "id")
+        records = sorted(records,
+                         key=lambda r: r.get(sort.lstrip("-")),
+                         reverse=sort.startswith("-"))
+        start = int(params.get("start", 0))
+        count = min(int(params.get("count", 20)), self.max_page_size)
+        fields = params.get("fields", "id")
+        names = None if fields == "*" else [
+            f.strip() for f in fields.split(",")
+        ]
+        data = [
+            r if names is None else {n: r.get(n)
+                                     for n in names}
+            for r in records[start:start + count]
+        ]
+        return {
+            "total": len(records),
+            "start": start,
+            "count": len(data),
+            "data": data
+        }
+
+    def capture(self, params):
+        with self.lock:
+            if "requestId" in params:
+                return self.last_batch
+            size = min(int(params.get("maxEvents", 100)), self.pending_events)
+            if not size:
+                return None
+            self.pending_events -= size
+            self.request_id += 1
+            self.last_batch = {
+                "requestId":
+                self.request_id,
+                "events": [{
+                    "eventId": f"{self.request_id}-{i}",
+                    "eventType": "ENTITY",
+                    "entityName": "Candidate",
+                    "entityId": i + 1,
+                    "entityEventType": "UPDATED",
+                    "updatedProperties": ["status"]
+                } for i in range(size)]
+            }
+            return self.last_batch
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = 1 << 16
+    bullhorn = None
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, payload=None, headers=None):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if len(body) >= 1024 and \
+                "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def handle_request(self):
+        bullhorn = self.bullhorn
+        url = parse.urlparse(self.path)
+        params = {k: v[0] for k, v in parse.parse_qs(url.query).items()}
+        parts = [p for p in url.path.split("/") if p]
+        body = self.body()
+        bullhorn.count("requests")
+
+        if url.path == "/oauth/authorize":
+            return self.send(302, headers={"Location": "/callback?code=abc"})
+        if url.path == "/callback":
+            return self.send(200, {})
+        if url.path == "/oauth/token":
+            bullhorn.count("token_grants")
+            return self.send(200, {
+                "access_token": secrets.token_hex(8),
+                "refresh_token": secrets.token_hex(8)
+            })
+        if url.path == "/rest-services/login":
+            return self.send(200, {
+                "BhRestToken": bullhorn.issue_session(),
+                "restUrl": bullhorn.url + "/"
+            })
+
+        if bullhorn.throttled():
+            return self.send(429, {"errorMessage": "Too many requests"},
+                             {"Retry-After": "1"})
+        delay = bullhorn.latency + bullhorn.jitter * secrets.randbelow(
+            1000) / 1000
+        if secrets.randbelow(10000) < bullhorn.tail_fraction * 10000:
+            delay += bullhorn.tail_latency
+        if delay:
+            time.sleep(delay)
+        expires = bullhorn.session_expires(self.headers.get("BhRestToken"))
+        if expires is None:
+            bullhorn.count("unauthorized")
+            return self.send(401, {"errorMessage": "Bad 'BhRestToken'"})
+
+        if parts == ["ping"]:
+            return self.send(200, {"sessionExpires": expires * 1000})
+        if parts[0] in ("query", "search"):
+            if self.command == "POST":
+                params = json.loads(body or b"{}")
+            clause = params.get("where") or params.get("query") or ""
+            records = bullhorn.select(clause, parts[0] == "search")
+            return self.send(200, bullhorn.page(records, params))
+        if parts[0] == "event":
+            if parts[-1] == "lastRequestId":
+                return self.send(200, {"result": bullhorn.request_id})
+            batch = bullhorn.capture(params)
+            return self.send(200, batch)
+        if parts[0] == "entity":
+            return self.entity(parts, params, body)
+        if parts[0] == "file":
+            return self.file(parts)
+        return self.send(404, {"errorMessage": "Unknown endpoint"})
+
+    def entity(self, parts, params, body):
+        bullhorn = self.bullhorn
+        entity = parts[1]
+        if self.command == "PUT" and len(parts) == 2:
+            with bullhorn.lock:
+                new_id = len(bullhorn.by_id) + 1
+            return self.send(200, {
+                "changedEntityType": entity,
+                "changedEntityId": new_id,
+                "changeType": "INSERT"
+            })
+        if self.command in ("POST", "DELETE"):
+            return self.send(200, {
+                "changedEntityType": entity,
+                "changedEntityId": int(parts[2]),
+                "changeType": "UPDATE" if self.command == "POST" else "DELETE"
+            })
+        ids = [int(i) for i in parts[2].split(",")]
+        if parts[3:] == ["fileAttachments"]:
+            return self.send(200, {
+                "data": [{
+                    "id": i * 100 + n,
+                    "name": f"cv-{i}-{n}.pdf",
+                    "contentType": "application/pdf",
+                    "fileSize": bullhorn.file_size
+                } for i in ids for n in range(bullhorn.files_per_record)]
+            })
+        found = [bullhorn.by_id[i] for i in ids if i in bullhorn.by_id]
+        if len(parts) > 3:
+            return self.send(200, {
+                "total": len(found),
+                "start": 0,
+                "count": len(found),
+                "data": found
+            })
+        if len(ids) == 1:
+            if not found:
+                return self.send(404, {"errorMessage": "Not found"})
+            return self.send(200, {"data": found[0]})
+        return self.send(200, {"data": found})
+
+    def file(self, parts):
+        bullhorn = self.bullhorn
+        if self.command == "PUT":
+            bullhorn.count("uploads")
+            return self.send(200, {
+                "fileId": int(parts[2]) * 100 + bullhorn.files_per_record,
+                "changeType": "ADD"
+            })
+        bullhorn.count("downloads")
+        size, status = bullhorn.file_size, 200
+        start = 0
+        match = _byte_range.match(self.headers.get("Range", ""))
+        if match:
+            start, status = int(match.group(1)), 206
+            if start >= size:
+                return self.send(416, {"errorMessage": "Bad range"})
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size - start))
+        if status == 206:
+            self.send_header("Content-Range",
+                             f"bytes {start}-{size - 1}/{size}")
+        self.end_headers()
+        content = memoryview(bullhorn.file_content)
+        for offset in range(start, size, 1 << 16):
+            self.wfile.write(content[offset:min(offset + (1 << 16), size)])
+        self.wfile.flush()
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_request
@@ -0,0 +1,302 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import functools
+import json
+import logging
+from datetime import datetime
+from typing import AnyStr
+from urllib import parse
+
+import pyhorn.auth
+from pyhorn.client import _immutable_entities
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+__all__ = ['AsyncRESTClient']
+
+_logger = logging.getLogger("pyhorn")
+
+
+def _join_ids(entity_ids) -> str:
+    if type(entity_ids) is int:
+        return str(entity_ids)
+    elif type(entity_ids) is list and type(entity_ids[0]) is int:
+        return ','.join([str(i) for i in entity_ids])
+    raise TypeError("entityIds should be of type int or list(int)")
+
+
+class AsyncRESTClient():
+    """ asyncio counterpart of `pyhorn.client.RESTClient`, built on aiohttp.
+
+        At most `max_concurrency` requests are in flight at once, and a 401
+        triggers a single shared renewal of the credentials no matter how many
+        requests were waiting on it.
+    """
+    def __init__(self,
+                 auth: pyhorn.auth.Credentials,
+                 max_concurrency: int = 100,
+                 limit_per_host: int = 0,
+                 keepalive_timeout: float = 15,
+                 connect_timeout: float = None,
+                 read_timeout: float = None):
+        if aiohttp is None:
+            raise ImportError("AsyncRESTClient requires aiohttp; install it "
+                              "with `pip install pyhorn-flow[async]`.")
+        self.auth = auth
+        self.max_concurrency = max_concurrency
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                             sock_read=read_timeout)
+        self.session = None
+        self._slots = None
+        self._renewal = None
+
+    def __compose_url(self, *args):
+        return "/".join(args)
+
+    async def open_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=self.timeout)
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._renewal = asyncio.Lock()
+        return self.session
+
+    async def close_session(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def renew(self, stale_token=None):
+        """ Renews the credentials unless another task already did it since
+            `stale_token` was sent.
+        """
+        async with self._renewal:
+            if stale_token is not None and \
+                    self.auth.__dict__.get("BhRestToken") != stale_token:
+                return
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, functools.partial(self.auth.renew, stale_token))
+
+    async def safe_request(self, method, url, max_retries=1, **kwargs):
+        session = await self.open_session()
+        headers = kwargs.pop("headers", None) or {}
+        for attempt in range(max_retries + 1):
+            token = self.auth.BhRestToken
+            async with self._slots:
+                async with session.request(method,
+                                           url,
+                                           headers={
+                                               "BhRestToken": token,
+                                               **headers
+                                           },
+                                           **kwargs) as response:
+                    await response.read()
+            if response.status == 401 and attempt < max_retries:
+                await self.renew(token)
+                continue
+            if response.status >= 400:
+                _logger.error("%s %s returned %s", method, url,
+                              response.status)
+            response.raise_for_status()
+            return response
+
+    async def authenticate(self):
+        expiration = await self.ping()
+        if not expiration:
+            await self.renew()
+
+    async def ping(self) -> datetime:
+        """ Returns a datetime object with the current token's expiration,
+            or None if the token is already expired.
+        """
+        try:
+            full_url = self.__compose_url(self.auth.restUrl, "ping")
+            headers = {"BhRestToken": self.auth.BhRestToken}
+        except KeyError as e:
+            if e.args[0] in ("restUrl", "BhRestToken"):
+                return None
+            raise
+        session = await self.open_session()
+        async with session.get(full_url, headers=headers) as response:
+            if response.status == 401:
+                return None
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        return datetime.fromtimestamp(float(data["sessionExpires"]) / 1000.0)
+
+    async def get_entity(self, entity, entity_ids, **kwargs):
+        params = {a: v for a, v in kwargs.items()}
+        base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
+                                      _join_ids(entity_ids))
+        full_url = f"{base_url}?{parse.urlencode(params)}"
+        response = await self.safe_request("GET", full_url)
+        return await response.json(content_type=None)
+
+    async def get_tomany(self, entity, entity_ids, tomany, **kwargs):
+        params = {a: v for a, v in kwargs.items()}
+        base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
+                                      _join_ids(entity_ids), tomany)
+        full_url = f"{base_url}?{parse.urlencode(params)}"
+        response = await self.safe_request("GET", full_url)
+        return await response.json(content_type=None)
+
+    async def create_entity(self, entity, data):
+        base_url = self.__compose_url(self.auth.restUrl, "entity", entity)
+        response = await self.safe_request("PUT", base_url, json=data)
+        return await response.json(content_type=None)
+
+    async def create_tomany(self, entity, entity_id, tomany, tomany_ids):
+        base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
+                                      str(entity_id), tomany,
+                                      _join_ids(tomany_ids))
+        response = await self.safe_request("PUT", base_url)
+        return await response.json(content_type=None)
+
+    async def update_entity(self, entity, data):
+        base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
+                                      str(data["id"]))
+        response = await self.safe_request("POST", base_url, json=data)
+        return await response.json(content_type=None)
+
+    async def delete_entity(self, entity, entity_id):
+        if entity in _immutable_entities:
+            raise ValueError(
+                "The DELETE operation does not support this entity type.")
+
+        base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
+                                      str(entity_id))
+        response = await self.safe_request("DELETE", base_url)
+        return await response.json(content_type=None)
+
+    async def delete_tomany(self, entity, entity_id, tomany, tomany_ids):
+        base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
+                                      str(entity_id), tomany,
+                                      _join_ids(tomany_ids))
+        response = await self.safe_request("DELETE", base_url)
+        return await response.json(content_type=None)
+
+    async def query(self, entity, where, *args, **kwargs):
+        params = {"where": where, **{a: v for a, v in kwargs.items()}}
+        base_url = self.__compose_url(self.auth.restUrl, "query", entity)
+
+        if len(where) >= 7500:
+            response = await self.safe_request("POST", base_url, json=params)
+        else:
+            full_url = f"{base_url}?{parse.urlencode(params)}"
+            response = await self.safe_request("GET", full_url)
+
+        return await response.json(content_type=None)
+
+    async def search(self, entity, query, *args, **kwargs):
+        params = {"query": query, **{a: v for a, v in kwargs.items()}}
+        base_url = self.__compose_url(self.auth.restUrl, "search", entity)
+
+        if len(query) >= 7500:
+            response = await self.safe_request("POST", base_url, json=params)
+        else:
+            full_url = f"{base_url}?{parse.urlencode(params)}"
+            response = await self.safe_request("GET", full_url)
+
+        return await response.json(content_type=None)
+
+    async def capture(self, sub_id, max_events=100, **kwargs):
+        params = {"maxEvents": max_events, **{k: v for k, v in kwargs.items()}}
+
+        base_url = self.__compose_url(self.auth.restUrl, "event",
+                                      "subscription", sub_id)
+        full_url = f"{base_url}?{parse.urlencode(params)}"
+        response = await self.safe_request("GET", full_url)
+        # The body was read inside safe_request; text() reuses it
+        body = await response.text()
+        if body.strip():
+            return json.loads(body)
+        else:
+            return None
+
+    async def recapture(self, sub_id: AnyStr, request_id: int):
+        return await self.capture(sub_id, requestId=request_id)
+
+    async def get_last_capture_id(self, sub_id: AnyStr) -> int:
+        base_url = self.__compose_url(self.auth.restUrl, "event",
+                                      "subscription", sub_id, "lastRequestId")
+        response = await self.safe_request("GET", base_url)
+        return (await response.json(content_type=None))['result']
+
+    async def subscribe(self, sub_id):
+        full_url = self.__compose_url(self.auth.restUrl, "event",
+                                      "subscription", sub_id)
+        response = await self.safe_request("DELETE", full_url)
+        return await response.json(content_type=None)
+
+    async def delete_subscribe(self, sub_id: AnyStr):
+        base_url = self.__compose_url(self.auth.restUrl, "event",
+                                      "subscription", sub_id)
+        response = await self.safe_request("DELETE", base_url)
+        return await response.json(content_type=None)
+
+    async def entity_file_attachment(self, entity, entity_ids, *args,
+                                     **kwargs):
+        params = {a: v for a, v in kwargs.items()}
+        base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
+                                      _join_ids(entity_ids), "fileAttachments")
+        full_url = f"{base_url}?{parse.urlencode(params)}"
+        response = await self.safe_request("GET", full_url)
+        return await response.json(content_type=None)
+
+    async def entity_edit_history(self, entity, where, *args, **kwargs):
+        params = {"where": where, **{a: v for a, v in kwargs.items()}}
+        base_url = self.__compose_url(self.auth.restUrl, "query",
+                                      f'{entity}EditHistory')
+        full_url = f"{base_url}?{parse.urlencode(params)}"
+        response = await self.safe_request("GET", full_url)
+        return await response.json(content_type=None)
+
+    async def entity_edit_history_field_change(self, entity, where, *args,
+                                               **kwargs):
+        params = {"where": where, **{a: v for a, v in kwargs.items()}}
+        base_url = self.__compose_url(self.auth.restUrl, "query",
+                                      f'{entity}EditHistoryFieldChange')
+        full_url = f"{base_url}?{parse.urlencode(params)}"
+        response = await self.safe_request("GET", full_url)
+        return await response.json(content_type=None)
+
+    async def __aenter__(self):
+        _logger.debug("Starting async REST Client...")
+        await self.open_session()
+        await self.authenticate()
+        _logger.debug("Authenticated!")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close_session()
+        _logger.debug("Closed async REST Client.")
+        _logger.info(f"Exiting with: {exc_type}, {exc_val}, {exc_tb}")
@@ -0,0 +1,101 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+__all__ = ['current_tomany', 'sync_tomany', 'sync_tomany_batch']
+
+
+def current_tomany(client, entity, entity_id, tomany, page_size=500):
+    """ Returns the ids currently associated through `tomany`, reading every
+        page of the association.
+    """
+    ids, start = [], 0
+    while True:
+        response = client.get_tomany(entity,
+                                     entity_id,
+                                     tomany,
+                                     fields="id",
+                                     count=page_size,
+                                     start=start)
+        batch = response.get("data") or []
+        ids.extend(record["id"] for record in batch)
+        start += len(batch)
+        total = response.get("total")
+        if not batch or total is None or start >= total:
+            return ids
+
+
+def sync_tomany(client,
+                entity,
+                entity_id,
+                tomany,
+                desired_ids,
+                current_ids=None,
+                chunk_size=200):
+    """ Makes the `tomany` association of one entity hold exactly
+        `desired_ids`, sending only the differences in chunks of `chunk_size`
+        ids per call. Pass `current_ids` when they are already known to skip
+        reading the association.
+
+        Returns a dict with the `added` and `removed` ids.
+    """
+    if current_ids is None:
+        current_ids = current_tomany(client, entity, entity_id, tomany)
+    current, desired = set(current_ids), set(desired_ids)
+    added = sorted(desired - current)
+    removed = sorted(current - desired)
+
+    for i in range(0, len(removed), chunk_size):
+        client.delete_tomany(entity, entity_id, tomany,
+                             removed[i:i + chunk_size])
+    for i in range(0, len(added), chunk_size):
+        client.create_tomany(entity, entity_id, tomany,
+                             added[i:i + chunk_size])
+    return {"added": added, "removed": removed}
+
+
+def sync_tomany_batch(client,
+                      entity,
+                      tomany,
+                      desired_by_id: dict,
+                      concurrency=8,
+                      chunk_size=200):
+    """ Runs `sync_tomany` for every `{entity_id: desired_ids}` pair with up
+        to `concurrency` parents at once, yielding `(entity_id, result,
+        error)` as each one finishes. A failing parent does not stop the
+        others.
+    """
+    def sync(entity_id, desired_ids):
+        return sync_tomany(client,
+                           entity,
+                           entity_id,
+                           tomany,
+                           desired_ids,
+                           chunk_size=chunk_size)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(sync, entity_id, desired_ids): entity_id
+            for entity_id, desired_ids in desired_by_id.items()
+        }
+        for future in as_completed(futures):
+            error = future.exception()
+            yield (futures[future], None if error else future.result(), error)
@@ -18,11 +18,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import json
+import threading
 from typing import AnyStr
 from urllib import parse
 
 import requests
 
+import pyhorn.sessions
+
 __all__ = ['Credentials']
 
 _scheme = "https"
@@ -32,10 +35,27 @@ _token_path = "/oauth/token"
 _authorize_path = "/oauth/authorize"
 _login_path = "/rest-services/login"
 
+# (connect, read) seconds for token and login calls left without a timeout
+_default_timeout = (10, 60)
+
+_session_fields = [
+    "access_token", "refresh_token", "restUrl", "BhRestToken",
+    "sessionExpires"
+]
+
 
 class Credentials:
-    def __init__(self, file_name: AnyStr):
+    """ Bullhorn credentials and the session obtained with them.
+
+        The session is persisted in `store`, which defaults to a
+        `pyhorn.sessions.FileSessionStore` on `file_name`. Processes sharing a
+        store adopt each other's renewed tokens instead of logging in again.
+    """
+    def __init__(self, file_name: AnyStr, store=None):
         self.file_name = file_name
+        self.__dict__["_renewal_lock"] = threading.RLock()
+        self.__dict__["_store"] = (store or
+                                   pyhorn.sessions.FileSessionStore(file_name))
 
     def __setattr__(self, attr, value):
         self.__dict__[attr] = value
@@ -44,16 +64,91 @@ class Credentials:
         return self.__dict__[attr]
 
     @classmethod
-    def from_json(cls, json_file: AnyStr):
-        instance = cls(json_file)
+    def from_json(cls, json_file: AnyStr, store=None):
+        instance = cls(json_file, store)
         with open(json_file) as stream:
             for k, v in json.load(stream).items():
                 setattr(instance, k, v)
+        if store is not None:
+            instance.reload()
         return instance
 
+    @property
+    def store(self):
+        return self.__dict__["_store"]
+
+    def reload(self) -> bool:
+        """ Adopts the session saved in the store, returning whether it
+            differs from the one held in memory.
+        """
+        stored = self.store.load()
+        changed = stored.get("BhRestToken") not in (
+            None, self.__dict__.get("BhRestToken"))
+        for k in _session_fields:
+            if k in stored:
+                self.__dict__[k] = stored[k]
+        return changed
+
+    def bind_session(self, session: requests.Session, timeout=None):
+        """ Routes token and login calls through `session` so they share the
+            REST client's connection pool, with the client's (connect, read)
+            `timeout`. Passing None restores the default.
+        """
+        self.__dict__["_session"] = session
+        self.__dict__["_timeout"] = timeout
+
+    @property
+    def renewal_lock(self):
+        return self.__dict__["_renewal_lock"]
+
+    @property
+    def http(self):
+        return self.__dict__.get("_session") or requests
+
+    @property
+    def timeout(self) -> tuple:
+        """ (connect, read) timeout of token and login calls: the one given
+            to `renew`, else the bound client's, with `_default_timeout`
+            filling whatever is unset.
+        """
+        timeout = self.__dict__.get("_call_timeout") or \
+            self.__dict__.get("_timeout")
+        if timeout is None:
+            return _default_timeout
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        return tuple(d if t is None else t
+                     for t, d in zip(timeout, _default_timeout))
+
+    def __public(self) -> dict:
+        return {
+            k: v
+            for k, v in self.__dict__.items() if not k.startswith("_")
+        }
+
     def save(self):
-        with open(self.file_name, 'w') as stream:
-            json.dump(self.__dict__, stream, indent=True)
+        """ Persists the credentials. A session saved by another process
+            in the meantime is adopted rather than overwritten.
+        """
+        with self.renewal_lock, self.store.lock():
+            stored = self.store.load()
+            if stored.get("BhRestToken") not in (
+                    None, self.__dict__.get("BhRestToken")):
+                self.reload()
+            self.store.save(self.__public())
+
+    def __url(self, host: AnyStr, path: AnyStr, query: dict) -> AnyStr:
+        """ Builds an auth/login url. `scheme`, `auth_endpoint` and
+            `rest_endpoint` can be set in the credentials file to target
+            another data center (or a test server).
+        """
+        scheme = self.__dict__.get("scheme", _scheme)
+        if host == "auth":
+            netloc = self.__dict__.get("auth_endpoint", _auth_endpoint)
+        else:
+            netloc = self.__dict__.get("rest_endpoint", _rest_endpoint)
+        return parse.urlunparse(
+            (scheme, netloc, path, '', parse.urlencode(query), ''))
 
     def get_authorization_code(self) -> AnyStr:
         params = {"client_id": self.client_id, "response_type": "code"}
@@ -62,10 +157,10 @@ class Credentials:
             "password": self.password,
             "action": "Login"
         }
-        endpoint = parse.urlunparse(
-            (_scheme, _auth_endpoint, _authorize_path, '',
-             parse.urlencode(params), ''))
-        response = requests.post(endpoint, login_data)
+        endpoint = self.__url("auth", _authorize_path, params)
+        response = self.http.post(endpoint,
+                                  login_data,
+                                  timeout=self.timeout)
         authcode_url = parse.urlparse(response.url)
         query_string = parse.parse_qs(authcode_url.query)
 
@@ -78,9 +173,8 @@ class Credentials:
             "client_id": self.client_id,
             "client_secret": self.client_secret
         }
-        endpoint = parse.urlunparse((_scheme, _auth_endpoint, _token_path, '',
-                                     parse.urlencode(request_params), ''))
-        response = requests.post(endpoint)
+        endpoint = self.__url("auth", _token_path, request_params)
+        response = self.http.post(endpoint, timeout=self.timeout)
         response.raise_for_status()
         credentials = response.json()
 
@@ -95,9 +189,8 @@ class Credentials:
             "client_id": self.client_id,
             "client_secret": self.client_secret
         }
-        endpoint = parse.urlunparse((_scheme, _auth_endpoint, _token_path, '',
-                                     parse.urlencode(renewal_params), ''))
-        response = requests.post(endpoint)
+        endpoint = self.__url("auth", _token_path, renewal_params)
+        response = self.http.post(endpoint, timeout=self.timeout)
         response.raise_for_status()
         credentials = response.json()
 
@@ -107,16 +200,36 @@ class Credentials:
 
     def login(self) -> dict:
         query = {"access_token": self.access_token, "version": "*"}
-        endpoint = parse.urlunparse((_scheme, _rest_endpoint, _login_path, '',
-                                     parse.urlencode(query), ''))
-        response = requests.post(endpoint)
+        endpoint = self.__url("rest", _login_path, query)
+        response = self.http.post(endpoint, timeout=self.timeout)
         response.raise_for_status()
         login_data = response.json()
 
         (self.restUrl, self.BhRestToken) = (login_data["restUrl"],
                                             login_data["BhRestToken"])
 
-    def renew(self):
+    def renew(self, stale_token: AnyStr = None, timeout=None) -> bool:
+        """ Renews the session, which is `stale_token` or else the one held
+            in memory. Threads and processes sharing the store are serialized;
+            a caller whose session was already replaced by someone else, or
+            who held none while another process saved one, adopts it and
+            returns False without touching the network.
+            `timeout` overrides the (connect, read) timeout of each call.
+        """
+        with self.renewal_lock, self.store.lock():
+            self.__dict__["_call_timeout"] = timeout
+            try:
+                return self.__renew(stale_token)
+            finally:
+                self.__dict__["_call_timeout"] = None
+
+    def __renew(self, stale_token):
+        stale_token = stale_token or self.__dict__.get("BhRestToken")
+        # A token saved by another process is adopted even when this one held
+        # none yet; if it is dead too, the next request's 401 renews it
+        if self.reload() or (stale_token is not None and
+                             self.__dict__.get("BhRestToken") != stale_token):
+            return False
         if "refresh_token" in self.__dict__:
             try:
                 self.renew_token()
@@ -127,4 +240,6 @@ class Credentials:
         else:
             self.issue_token()
         self.login()
-        self.save()
+        self.__dict__.pop("sessionExpires", None)
+        self.store.save(self.__public())
+        return True
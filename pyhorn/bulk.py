@@ -0,0 +1,139 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+__all__ = ['BulkOperation', 'BulkResult', 'bulk_write']
+
+BulkOperation = namedtuple("BulkOperation", ["action", "entity", "data"])
+BulkOperation.__doc__ = """ A single write for `bulk_write`.
+
+    `action` is one of "create", "update" or "delete". `data` is the entity
+    payload for create/update (update needs its `id`), and the entity id (or
+    a payload holding it) for delete.
+"""
+
+BulkResult = namedtuple("BulkResult",
+                        ["index", "operation", "id", "changedEntityId",
+                         "error"])
+
+_throttle_statuses = [429, 503]
+_transient_statuses = [500, 502, 504]
+
+
+def _not_sent(error: Exception) -> bool:
+    """ Whether the request failed before reaching the server. """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _is_transient(operation: BulkOperation, error: Exception) -> bool:
+    """ Whether retrying `operation` after `error` is safe. Creates and
+        updates the server may already have applied are not replayed.
+    """
+    idempotent = operation.action == "delete"
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status in _throttle_statuses or \
+            (idempotent and status in _transient_statuses)
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return idempotent or _not_sent(error)
+    return False
+
+
+def _entity_id(operation: BulkOperation):
+    if isinstance(operation.data, dict):
+        return operation.data.get("id")
+    return operation.data
+
+
+def _send(client, operation: BulkOperation):
+    if operation.action == "create":
+        return client.create_entity(operation.entity, operation.data)
+    elif operation.action == "update":
+        return client.update_entity(operation.entity, operation.data)
+    elif operation.action == "delete":
+        return client.delete_entity(operation.entity,
+                                    str(_entity_id(operation)))
+    raise ValueError(f"Unknown bulk action: {operation.action}")
+
+
+def _run(client, index, operation, max_retries, backoff):
+    for attempt in range(max_retries + 1):
+        try:
+            response = _send(client, operation)
+            return BulkResult(index, operation, _entity_id(operation),
+                              response.get("changedEntityId"), None)
+        except Exception as e:
+            if attempt == max_retries or not _is_transient(operation, e):
+                return BulkResult(index, operation, _entity_id(operation),
+                                  None, e)
+            time.sleep(backoff * 2**attempt * (1 + random.random()))
+
+
+def bulk_write(client,
+               operations,
+               concurrency=8,
+               max_retries=3,
+               backoff=0.5,
+               immutable_entities=()):
+    """ Runs a stream of create/update/delete operations with at most
+        `concurrency` of them in flight, and yields a `BulkResult` for each
+        one as it completes. `index` is the operation's position in the input.
+
+        429 and 503 responses and connections that could not be opened are
+        retried up to `max_retries` times with exponential backoff. Deletes
+        are also retried after other connection errors, timeouts and 5xx
+        responses; creates and updates are not, since the server may already
+        have applied them. Any other failure is reported in the result's
+        `error` and does not stop the batch.
+        Operations on `immutable_entities` are refused without a request.
+    """
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    in_flight = set()
+    try:
+        for index, operation in enumerate(operations):
+            operation = BulkOperation(*operation)
+            if operation.entity in immutable_entities:
+                yield BulkResult(
+                    index, operation, _entity_id(operation), None,
+                    ValueError(f"{operation.entity} is an immutable entity."))
+                continue
+            if len(in_flight) >= concurrency:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            in_flight.add(
+                executor.submit(_run, client, index, operation, max_retries,
+                                backoff))
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,353 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import pyhorn.fields
+
+__all__ = ['REFERENCE_ENTITIES', 'ReferenceCache', 'EntityCache']
+
+REFERENCE_ENTITIES = [
+    "BusinessSector", "Category", "Country", "Skill", "Specialty", "State",
+    "TimeUnit"
+]
+
+_logger = logging.getLogger("pyhorn")
+
+
+def _field_set(fields) -> frozenset:
+    names = pyhorn.fields.field_names(fields or "id")
+    return frozenset(name.split("(")[0].strip() for name in names)
+
+
+def _project(record: dict, fields: frozenset) -> dict:
+    if "*" in fields:
+        return dict(record)
+    return {k: v for k, v in record.items() if k in fields or k == "id"}
+
+
+class _Store:
+    """ Thread-safe LRU of entity records keyed by (entity, id), remembering
+        which fields each record was read with. A lookup hits only when the
+        stored fields cover the requested ones.
+    """
+    def __init__(self, max_size=10000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, entity, entity_id, fields: frozenset):
+        key = (entity, entity_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, stored_fields, record = entry
+                if expires is not None and expires < time.monotonic():
+                    del self.entries[key]
+                    self.evictions += 1
+                elif "*" in stored_fields or fields <= stored_fields:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return _project(record, fields)
+            self.misses += 1
+            return None
+
+    def put(self, entity, record: dict, fields: frozenset, expires=None):
+        key = (entity, record["id"])
+        if expires is None and self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        with self.lock:
+            current = self.entries.get(key)
+            if current is not None and current[0] is not None and \
+                    current[0] >= time.monotonic():
+                fields = fields | current[1]
+                record = {**current[2], **record}
+            self.entries[key] = (expires, fields, record)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def evict(self, entity, entity_id) -> bool:
+        with self.lock:
+            if self.entries.pop((entity, entity_id), None) is not None:
+                self.evictions += 1
+                return True
+            return False
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ReferenceCache:
+    """ Read-through cache for reference entities that never change in
+        practice (countries, categories, skills...).
+
+        Records live in an in-memory LRU for `ttl` seconds and, when `path`
+        is given, in a SQLite file that survives process restarts. `warm`
+        loads a whole reference table in one paginated query so that later
+        lookups by id never leave the process.
+    """
+    def __init__(self,
+                 entities=REFERENCE_ENTITIES,
+                 max_size=50000,
+                 ttl=24 * 3600,
+                 path=None):
+        self.entities = set(entities)
+        self.memory = _Store(max_size=max_size, ttl=ttl)
+        self.path = path
+        self.disk = None
+        if path is not None:
+            self.disk = sqlite3.connect(path, check_same_thread=False)
+            self.disk.execute("CREATE TABLE IF NOT EXISTS reference_cache ("
+                              "entity TEXT, id INTEGER, fields TEXT, "
+                              "expires REAL, record TEXT, "
+                              "PRIMARY KEY (entity, id))")
+            self.disk.commit()
+
+    def __contains__(self, entity):
+        return entity in self.entities
+
+    def get(self, entity, entity_id, fields=None):
+        wanted = _field_set(fields)
+        record = self.memory.get(entity, entity_id, wanted)
+        if record is None and self.disk is not None:
+            record = self.__load(entity, entity_id, wanted)
+        return record
+
+    def put(self, entity, record, fields=None, generation=None):
+        """ Stores `record`. `generation` is accepted for symmetry with
+            `EntityCache.put`; reference records are not invalidated.
+        """
+        stored = _field_set(fields)
+        self.memory.put(entity, record, stored)
+        if self.disk is not None:
+            ttl = self.memory.ttl
+            expires = time.time() + ttl if ttl is not None else None
+            with self.memory.lock:
+                self.disk.execute(
+                    "INSERT OR REPLACE INTO reference_cache "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (entity, record["id"], ",".join(sorted(stored)), expires,
+                     json.dumps(record)))
+                self.disk.commit()
+
+    def __load(self, entity, entity_id, wanted):
+        with self.memory.lock:
+            row = self.disk.execute(
+                "SELECT fields, expires, record FROM reference_cache "
+                "WHERE entity = ? AND id = ?", (entity, entity_id)).fetchone()
+        if row is None:
+            return None
+        fields, expires, record = row
+        stored = frozenset(fields.split(","))
+        if expires is not None and expires < time.time():
+            return None
+        if "*" not in stored and not wanted <= stored:
+            return None
+        record = json.loads(record)
+        if expires is not None:
+            expires = time.monotonic() + expires - time.time()
+        self.memory.put(entity, record, stored, expires)
+        return _project(record, wanted)
+
+    @property
+    def generation(self) -> int:
+        return 0
+
+    def sync(self, client):
+        pass
+
+    def warm(self, client, entities=None, fields="*"):
+        """ Loads every record of `entities` (all cached ones by default)
+            with one paginated query each.
+        """
+        for entity in entities or sorted(self.entities):
+            for record in client.iter_query(entity,
+                                            "id>0",
+                                            fields=fields,
+                                            page_size=500,
+                                            keyset=True):
+                self.put(entity, record, fields)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.memory.hits,
+            "misses": self.memory.misses,
+            "evictions": self.memory.evictions,
+            "size": len(self.memory.entries)
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+
+class EntityCache:
+    """ Cache for `get_entity` results that stays fresh by reading a Bullhorn
+        event subscription.
+
+        `sub_id` must be an existing entity subscription covering `entities`
+        (every entity when None). Before serving reads the cache consumes the
+        pending events, at most once every `sync_interval` seconds: DELETED
+        events evict the record, and UPDATED events evict it only when one of
+        the changed properties was cached, otherwise the entry is kept as is.
+        If the subscription cannot be read the whole cache is dropped, since
+        it can no longer know what changed.
+
+        A record read from the API while a sync runs may predate an event
+        that sync already consumed, so callers take `generation` before the
+        read and pass it to `put`, which then drops records touched by an
+        event (or invalidated by a failed sync) in the meantime.
+    """
+    def __init__(self,
+                 sub_id,
+                 entities=None,
+                 max_size=10000,
+                 ttl=None,
+                 sync_interval=1.0,
+                 max_events=500):
+        self.sub_id = sub_id
+        self.entities = None if entities is None else set(entities)
+        self.memory = _Store(max_size=max_size, ttl=ttl)
+        self.sync_interval = sync_interval
+        self.max_events = max_events
+        self.last_sync = None
+        self.events = 0
+        self.sync_lock = threading.Lock()
+        self.generation = 0
+        self.__touched = OrderedDict()
+        self.__forgotten = 0
+
+    def __contains__(self, entity):
+        return self.entities is None or entity in self.entities
+
+    def get(self, entity, entity_id, fields=None):
+        return self.memory.get(entity, entity_id, _field_set(fields))
+
+    def put(self, entity, record, fields=None, generation=None):
+        """ Stores `record`, unless it was read before `generation` ended and
+            an event about it has been applied since.
+        """
+        with self.memory.lock:
+            if generation is not None and \
+                    (self.__forgotten > generation or self.__touched.get(
+                        (entity, record["id"]), 0) > generation):
+                return
+            self.memory.put(entity, record, _field_set(fields))
+
+    def sync(self, client):
+        """ Refreshes the cache at most every `sync_interval` seconds. When
+            the subscription cannot be read the cache is emptied and the
+            error logged, so lookups fall through to the API instead of
+            failing; the next attempt waits for the following interval.
+        """
+        now = time.monotonic()
+        if self.last_sync is not None and \
+                now - self.last_sync < self.sync_interval:
+            return
+        if not self.sync_lock.acquire(blocking=False):
+            return
+        try:
+            self.refresh(client)
+        except Exception as e:
+            _logger.error(f"Could not read subscription {self.sub_id}, "
+                          f"cache cleared: {e!r}")
+        finally:
+            self.last_sync = time.monotonic()
+            self.sync_lock.release()
+
+    def refresh(self, client) -> int:
+        """ Applies every pending event of the subscription and returns how
+            many were read.
+        """
+        applied = 0
+        try:
+            while True:
+                response = client.capture(self.sub_id, self.max_events)
+                events = (response or {}).get("events") or []
+                self.apply(events)
+                applied += len(events)
+                if len(events) < self.max_events:
+                    return applied
+        except Exception:
+            with self.memory.lock:
+                self.generation += 1
+                self.__forgotten = self.generation
+                self.memory.clear()
+            raise
+
+    def apply(self, events):
+        if not events:
+            return
+        with self.memory.lock:
+            self.generation += 1
+        for event in events:
+            self.events += 1
+            entity, entity_id = event.get("entityName"), event.get("entityId")
+            self.__touch((entity, entity_id))
+            kind = event.get("entityEventType")
+            if kind == "DELETED":
+                self.memory.evict(entity, entity_id)
+            elif kind == "UPDATED":
+                self.__patch(entity, entity_id,
+                             event.get("updatedProperties"))
+
+    def __touch(self, key):
+        """ Remembers the generation of the last event about `key`, for as
+            many keys as the cache holds; older ones are only known to be
+            no newer than `__forgotten`.
+        """
+        with self.memory.lock:
+            self.__touched[key] = self.generation
+            self.__touched.move_to_end(key)
+            while len(self.__touched) > self.memory.max_size:
+                _, generation = self.__touched.popitem(last=False)
+                self.__forgotten = max(self.__forgotten, generation)
+
+    def __patch(self, entity, entity_id, updated):
+        with self.memory.lock:
+            entry = self.memory.entries.get((entity, entity_id))
+            if entry is None:
+                return
+            stored_fields = entry[1]
+            if not updated or "*" in stored_fields or \
+                    stored_fields & set(updated):
+                self.memory.evict(entity, entity_id)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.memory.hits,
+            "misses": self.memory.misses,
+            "evictions": self.memory.evictions,
+            "events": self.events,
+            "size": len(self.memory.entries)
+        }
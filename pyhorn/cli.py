@@ -0,0 +1,240 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import time
+
+import pyhorn.auth
+import pyhorn.client
+import pyhorn.events
+import pyhorn.fields
+
+__all__ = ['export', 'main']
+
+
+class _Output:
+    """ Export file that can be cut at a consistent point.
+
+        `mark` flushes everything written so far (closing the current gzip
+        member when compressing) and returns the file size, so a resumed
+        export can truncate the file back to it and append: gzip readers
+        treat the concatenated members as one stream.
+    """
+    def __init__(self, file_name, fmt, fields, compress, offset=None):
+        self.fmt = fmt
+        self.compress = compress
+        self.columns = None
+        names = pyhorn.fields.field_names(fields)
+        if fmt == "csv" and "*" not in names:
+            self.columns = [n.split("(")[0].strip() for n in names]
+        self.raw = open(file_name, "r+b" if offset is not None else "wb")
+        if offset is not None:
+            self.raw.truncate(offset)
+            self.raw.seek(offset)
+        self.header = fmt == "csv" and not offset
+        self.__open()
+
+    def __open(self):
+        self.member = (gzip.GzipFile(fileobj=self.raw, mode="wb")
+                       if self.compress else None)
+        self.text = io.TextIOWrapper(self.member or self.raw,
+                                     encoding="utf-8",
+                                     newline="")
+        self.csv = csv.writer(self.text) if self.fmt == "csv" else None
+
+    def write(self, record: dict):
+        if self.fmt == "ndjson":
+            self.text.write(json.dumps(record, separators=(",", ":")))
+            self.text.write("\n")
+            return
+        if self.columns is None:
+            self.columns = list(record)
+        if self.header:
+            self.csv.writerow(self.columns)
+            self.header = False
+        self.csv.writerow([
+            json.dumps(v) if isinstance(v, (dict, list)) else v
+            for v in (record.get(c) for c in self.columns)
+        ])
+
+    def __finish(self) -> int:
+        self.text.flush()
+        if self.member is not None:
+            self.text.detach()
+            self.member.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        return self.raw.tell()
+
+    def mark(self) -> int:
+        offset = self.__finish()
+        if self.member is not None:
+            self.__open()
+        return offset
+
+    def close(self) -> int:
+        offset = self.__finish()
+        if self.member is None:
+            self.text.detach()
+        self.raw.close()
+        return offset
+
+
+def export(client,
+           entity,
+           output,
+           where="id>0",
+           query=None,
+           fields="id",
+           fmt="ndjson",
+           compress=False,
+           workers=4,
+           page_size=500,
+           checkpoint=None,
+           checkpoint_every=5000,
+           report=None,
+           report_interval=5.0) -> int:
+    """ Streams every record of `entity` matching `where` (or the Lucene
+        `query`) to `output` as NDJSON or CSV, and returns how many records
+        the file holds.
+
+        Records are written in id order so that the export can be resumed:
+        every `checkpoint_every` records the last written id and the file size
+        are saved to the `checkpoint` file, and a later call with the same
+        checkpoint continues after that id, dropping anything written after
+        the checkpoint. Queries are read by `workers` concurrent id shards;
+        searches page through a single keyset cursor.
+    """
+    fields = pyhorn.fields.with_id(fields)
+    store = pyhorn.events.FileCheckpoint(checkpoint) if checkpoint else None
+    state = (store.load(entity) if store else None) or {}
+    last_id, written = state.get("last_id"), state.get("records", 0)
+
+    if query is not None:
+        clause = query if last_id is None else \
+            f"({query}) AND id:{{{last_id} TO *}}"
+        records = client.iter_search(entity,
+                                     clause,
+                                     fields=fields,
+                                     page_size=page_size,
+                                     keyset=True)
+    else:
+        clause = where if last_id is None else f"({where}) AND id > {last_id}"
+        records = client.scan(entity,
+                              clause,
+                              fields,
+                              workers=workers,
+                              shard_by="id",
+                              ordered=True,
+                              page_size=page_size)
+
+    out = _Output(output, fmt, fields, compress, state.get("offset"))
+    started = last_report = time.monotonic()
+    count = 0
+
+    def save(offset):
+        if store is not None:
+            store.save(entity, {
+                "last_id": last_id,
+                "records": written,
+                "offset": offset
+            })
+
+    try:
+        for record in records:
+            out.write(record)
+            last_id, written, count = record["id"], written + 1, count + 1
+            if count % checkpoint_every == 0:
+                save(out.mark())
+            now = time.monotonic()
+            if report is not None and now - last_report >= report_interval:
+                last_report = now
+                print(f"{entity}: {written} records, "
+                      f"{count / (now - started):.0f} records/s",
+                      file=report)
+    finally:
+        save(out.close())
+
+    if report is not None:
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(f"{entity}: done, {written} records "
+              f"({count / elapsed:.0f} records/s)",
+              file=report)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pyhorn", description="Bullhorn REST API command line tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    exporter = commands.add_parser(
+        "export", help="stream an entity to an NDJSON or CSV file")
+    exporter.add_argument("entity")
+    exporter.add_argument("--auth",
+                          default="auth.json",
+                          help="credentials file (default: auth.json)")
+    clause = exporter.add_mutually_exclusive_group()
+    clause.add_argument("--where", default="id>0", help="query where clause")
+    clause.add_argument("--search", help="Lucene search instead of a query")
+    exporter.add_argument("--fields", default="id")
+    exporter.add_argument("--format",
+                          choices=["ndjson", "csv"],
+                          default="ndjson")
+    exporter.add_argument("--output",
+                          help="output file (default: <entity>.<format>)")
+    exporter.add_argument("--gzip",
+                          action="store_true",
+                          help="gzip-compress the output")
+    exporter.add_argument("--workers", type=int, default=4)
+    exporter.add_argument("--page-size", type=int, default=500)
+    exporter.add_argument(
+        "--checkpoint",
+        help="checkpoint file used to resume an interrupted export "
+        "(default: <output>.checkpoint)")
+    exporter.add_argument("--checkpoint-every", type=int, default=5000)
+
+    args = parser.parse_args(argv)
+    output = args.output or f"{args.entity}.{args.format}" + (
+        ".gz" if args.gzip else "")
+    credentials = pyhorn.auth.Credentials.from_json(args.auth)
+    with pyhorn.client.RESTClient(credentials,
+                                  pool_maxsize=max(10,
+                                                   args.workers)) as client:
+        export(client,
+               args.entity,
+               output,
+               where=args.where,
+               query=args.search,
+               fields=args.fields,
+               fmt=args.format,
+               compress=args.gzip,
+               workers=args.workers,
+               page_size=args.page_size,
+               checkpoint=args.checkpoint or f"{output}.checkpoint",
+               checkpoint_every=args.checkpoint_every,
+               report=sys.stderr)
+    return 0
@@ -18,28 +18,40 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import contextlib
+import functools
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import AnyStr
 from urllib import parse
 
 import requests
+from requests.adapters import HTTPAdapter
 
+import pyhorn.associations
 import pyhorn.auth
-
-__all__ = ['RESTClient', 'set_logger_level']
+import pyhorn.bulk
+import pyhorn.cache
+import pyhorn.codec
+import pyhorn.fields
+import pyhorn.files
+import pyhorn.hedging
+import pyhorn.history
+import pyhorn.loader
+import pyhorn.metrics
+import pyhorn.results
+import pyhorn.scan
+import pyhorn.scheduler
+import pyhorn.streaming
+
+__all__ = ['RESTClient', 'set_logger_level', 'enable_file_logging']
 
 _logger = logging.getLogger("pyhorn")
-_logger.setLevel(logging.CRITICAL)
-_log_file_handler = logging.FileHandler(
-    f"pyhorn_{datetime.now().timestamp()}.log")
-_log_file_handler.setLevel(logging.DEBUG)
-_log_file_format = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-_log_file_handler.setFormatter(_log_file_format)
-
-_logger.addHandler(_log_file_handler)
+_logger.addHandler(logging.NullHandler())
 
 MAX_RECORDS = 200
 
@@ -53,57 +65,360 @@ def set_logger_level(level: AnyStr):
     _logger.setLevel(level)
 
 
+def enable_file_logging(file_name: AnyStr = None, level: AnyStr = "DEBUG"):
+    """ Writes pyhorn's log to `file_name`, by default a new
+        `pyhorn_<timestamp>.log` in the working directory.
+    """
+    handler = logging.FileHandler(file_name or
+                                  f"pyhorn_{datetime.now().timestamp()}.log")
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(
+        logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    _logger.addHandler(handler)
+    _logger.setLevel(level)
+    return handler
+
+
+def _endpoint(url: AnyStr, rest_url: AnyStr) -> AnyStr:
+    """ Groups a request url by operation and entity, e.g. `entity/Candidate`
+        or `event/subscription`, leaving ids and query strings out.
+    """
+    path = url[len(rest_url):] if url.startswith(rest_url) else url
+    return "/".join(path.split("?", 1)[0].strip("/").split("/")[:2])
+
+
 class RESTClient():
-    def __init__(self, auth: pyhorn.auth.Credentials):
+    def __init__(self,
+                 auth: pyhorn.auth.Credentials,
+                 pool_connections: int = 10,
+                 pool_maxsize: int = 10,
+                 keep_alive: bool = True,
+                 connect_timeout: float = None,
+                 read_timeout: float = None,
+                 ids_per_request: int = MAX_RECORDS,
+                 fan_out_workers: int = 4,
+                 reference_cache: pyhorn.cache.ReferenceCache = None,
+                 entity_cache: pyhorn.cache.EntityCache = None,
+                 refresh_margin: float = 60,
+                 metrics: pyhorn.metrics.Metrics = None,
+                 scheduler: pyhorn.scheduler.Scheduler = None,
+                 codec: pyhorn.codec.JSONCodec = None,
+                 accept_encoding: str = "gzip, deflate",
+                 compress_threshold: int = None,
+                 content_encoding: str = "gzip",
+                 deadline: float = None,
+                 hedger: pyhorn.hedging.Hedger = None):
         self.auth = auth
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.timeout = (connect_timeout, read_timeout)
+        self.ids_per_request = ids_per_request
+        self.fan_out_workers = fan_out_workers
+        self.reference_cache = reference_cache
+        self.entity_cache = entity_cache
+        self.refresh_margin = refresh_margin
+        self.session_lifetime = None
+        self.metrics = metrics
+        self.scheduler = scheduler or pyhorn.scheduler.Scheduler()
+        self.codec = codec or pyhorn.codec.default_codec()
+        self.accept_encoding = accept_encoding
+        self.compress_threshold = compress_threshold
+        self.content_encoding = content_encoding
+        self.deadline = deadline
+        self.hedger = hedger
+        self.__scope = threading.local()
+        self.session = None
+
+    def open_session(self) -> requests.Session:
+        """ Creates the pooled HTTP session shared by every request made by
+            this client and by its credentials' token calls.
+        """
+        if self.session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                  pool_maxsize=self.pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if not self.keep_alive:
+                session.headers["Connection"] = "close"
+            if self.accept_encoding:
+                session.headers["Accept-Encoding"] = self.accept_encoding
+            self.session = session
+            self.auth.bind_session(session, self.timeout)
+        return self.session
+
+    def close_session(self):
+        if self.session is not None:
+            self.auth.bind_session(None)
+            self.session.close()
+            self.session = None
 
     def __compose_url(self, *args):
         return "/".join(args)
 
-    def safe_request(self, method, url, **kwargs):
+    @contextlib.contextmanager
+    def deadline_scope(self, seconds: float):
+        """ Bounds every request made by this thread inside the `with` block
+            (including retries, re-authentication and fan-out chunks) to end
+            within `seconds` from now. Nested scopes can only shorten it.
+        """
+        outer = getattr(self.__scope, "expires", None)
+        expires = time.monotonic() + seconds
+        self.__scope.expires = expires if outer is None else min(
+            outer, expires)
         try:
+            yield
+        finally:
+            self.__scope.expires = outer
+
+    def __carry_scope(self, function):
+        """ Wraps `function` to run under the calling thread's deadline scope
+            from whichever thread calls it.
+        """
+        expires = getattr(self.__scope, "expires", None)
+        if expires is None:
+            return function
+
+        def scoped(*args, **kwargs):
+            outer = getattr(self.__scope, "expires", None)
+            self.__scope.expires = expires
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.__scope.expires = outer
+
+        return scoped
+
+    def __expires(self, deadline=None):
+        """ Returns the `time.monotonic()` instant by which a request must
+            end: `deadline` seconds from now (the client's `deadline` when
+            not given), capped by the enclosing `deadline_scope`.
+        """
+        seconds = self.deadline if deadline is None else deadline
+        expires = None if seconds is None else time.monotonic() + seconds
+        scope = getattr(self.__scope, "expires", None)
+        if scope is not None:
+            expires = scope if expires is None else min(expires, scope)
+        return expires
+
+    def safe_request(self,
+                     method,
+                     url,
+                     max_auth_retries=2,
+                     deadline=None,
+                     hedge=False,
+                     **kwargs):
+        """ Sends an authenticated request, renewing the session on 401.
+
+            `deadline` (in seconds) bounds the whole call, retries included;
+            every attempt's timeouts are capped to the time left. With
+            `hedge` and a `hedger` on the client, a slow GET is duplicated
+            and the first answer wins.
+        """
+        if _logger.isEnabledFor(logging.DEBUG):
             _logger.debug(
                 json.dumps({
                     "endpoint": f"{method} {url}",
                     "request": kwargs
-                }))
-            kwargs["headers"] = {
-                **{
-                    "BhRestToken": self.auth.BhRestToken
                 },
-                **(kwargs.get("headers") or {})
-            }
-            response = requests.request(method, url, **kwargs)
-            _logger.debug(response.text)
-            response.raise_for_status()
-            return response
-        except requests.HTTPError as e:
-            if e.response.status_code == 401:
-                self.auth.renew()
-                return self.safe_request(method, url, **kwargs)
-            else:
-                print(response.text)
+                           default=str))
+        headers = kwargs.pop("headers", None) or {}
+        if kwargs.get("json") is not None:
+            headers, kwargs["data"] = self.__encode(headers,
+                                                    kwargs.pop("json"))
+        body = kwargs.get("data")
+        if hasattr(body, "seek") and hasattr(body, "tell"):
+            # File-like bodies are rewound before every retry
+            kwargs["rewind"] = body.tell()
+        kwargs.setdefault("timeout", self.timeout)
+        expires = self.__expires(deadline)
+        hedger = self.hedger if hedge and method == "GET" and \
+            not kwargs.get("stream") else None
+        for attempt in range(max_auth_retries + 1):
+            self.__refresh_if_expiring(expires)
+            token = self.auth.BhRestToken
+            try:
+                send = functools.partial(self.__send,
+                                         method,
+                                         url, {
+                                             "BhRestToken": token,
+                                             **headers
+                                         },
+                                         expires=expires,
+                                         **kwargs)
+                if hedger is not None:
+                    send = functools.partial(
+                        hedger.run, _endpoint(url, self.auth.restUrl), send,
+                        expires,
+                        functools.partial(self.scheduler.send_once, send),
+                        self.pool_maxsize * 2)
+                response = self.scheduler.run(method,
+                                              send,
+                                              on_retry=self.__count_retry,
+                                              deadline=expires)
+                if _logger.isEnabledFor(logging.DEBUG) and \
+                        not kwargs.get("stream"):
+                    _logger.debug(response.text)
+                response.raise_for_status()
+                return response
+            except requests.Timeout as e:
+                if expires is None or time.monotonic() < expires or \
+                        isinstance(e, pyhorn.scheduler.DeadlineExceeded):
+                    raise
+                raise pyhorn.scheduler.DeadlineExceeded(
+                    "request deadline exceeded") from e
+            except requests.HTTPError as e:
+                if e.response.status_code == 401 and \
+                        attempt < max_auth_retries:
+                    if self.metrics is not None:
+                        self.metrics.increment("retries")
+                    self.__renew(token, expires)
+                    continue
                 _logger.error(response.text)
                 raise
 
+    def __encode(self, headers, data):
+        """ Serializes a JSON body with the client's codec, compressing it
+            when it reaches `compress_threshold` bytes.
+        """
+        body = self.codec.dumps(data)
+        headers = {"Content-Type": "application/json", **headers}
+        if self.compress_threshold is not None and \
+                len(body) >= self.compress_threshold:
+            body = pyhorn.codec.compress(body, self.content_encoding)
+            headers["Content-Encoding"] = self.content_encoding
+        return headers, body
+
+    def __count_retry(self, response):
+        if self.metrics is not None:
+            self.metrics.increment("retries")
+            if response is not None and response.status_code == 429:
+                self.metrics.increment("throttled")
+
+    def __send(self,
+               method,
+               url,
+               headers,
+               rewind=None,
+               expires=None,
+               **kwargs):
+        if rewind is not None:
+            kwargs["data"].seek(rewind)
+        kwargs["timeout"] = self.__remaining(kwargs["timeout"], expires)
+        session = self.open_session()
+        metrics = self.metrics
+        if metrics is None:
+            return session.request(method, url, headers=headers, **kwargs)
+
+        metrics.started()
+        response, error = None, None
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, headers=headers, **kwargs)
+            return response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            bytes_out = bytes_in = 0
+            if response is not None:
+                body = response.request.body
+                bytes_out = len(body) if body else 0
+                length = response.headers.get("Content-Length")
+                if length is not None:
+                    bytes_in = int(length)
+                elif not kwargs.get("stream"):
+                    bytes_in = len(response.content)
+            metrics.finished(method, _endpoint(url, self.auth.restUrl),
+                             None if response is None else
+                             response.status_code, elapsed, bytes_out,
+                             bytes_in, error)
+
+    def __remaining(self, timeout, expires):
+        """ Caps each element of `timeout` to the time left before the
+            `expires` deadline, raising `DeadlineExceeded` once it passed.
+        """
+        if expires is None:
+            return timeout
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise pyhorn.scheduler.DeadlineExceeded(
+                "request deadline exceeded")
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        return tuple(remaining if t is None else min(t, remaining)
+                     for t in timeout)
+
+    def __renew(self, stale_token=None, expires=None):
+        """ Renews the session unless another thread already replaced
+            `stale_token`, then learns the new session's expiration. Token,
+            login and ping calls all end by the `expires` deadline.
+        """
+        if self.auth.renew(stale_token,
+                           self.__remaining(self.timeout, expires)):
+            if self.metrics is not None:
+                self.metrics.increment("reauths")
+            expiration = self.ping(self.__remaining(self.timeout, expires))
+            if expiration:
+                self.session_lifetime = expiration.timestamp() - time.time()
+
+    def __refresh_if_expiring(self, expires=None):
+        """ Checks the session shortly before `sessionExpires`, renewing it
+            only when a ping shows it really is about to expire. Concurrent
+            callers wait for the single check in progress.
+        """
+        if not self.__expiring():
+            return
+        with self.auth.renewal_lock:
+            if not self.__expiring():
+                return
+            expiration = self.ping(self.__remaining(self.timeout, expires))
+            if not expiration or self.__expiring():
+                self.__renew(expires=expires)
+
+    def __expiring(self) -> bool:
+        expires = self.auth.__dict__.get("sessionExpires")
+        if expires is None:
+            return False
+        margin = self.refresh_margin
+        if self.session_lifetime is not None:
+            margin = min(margin, self.session_lifetime / 4)
+        return float(expires) / 1000.0 - margin <= time.time()
+
     def authenticate(self):
+        """ Makes sure the session is usable. A session known to be valid
+            for longer than `refresh_margin` is trusted without a ping.
+        """
+        expires = self.auth.__dict__.get("sessionExpires")
+        if expires is not None and not self.__expiring():
+            return
         expiration = self.ping()
         if not expiration:
-            self.auth.renew()
+            self.__renew()
 
-    def ping(self) -> datetime:
+    def ping(self, timeout=None) -> datetime:
         """ Returns a datetime object with the current token's expiration,
-            or None if the token is already expired.
+            or None if the token is already expired. `timeout` overrides the
+            client's.
         """
         try:
             full_url = self.__compose_url(self.auth.restUrl, "ping")
             headers = {"BhRestToken": self.auth.BhRestToken}
-            response = requests.get(full_url, headers=headers)
+            response = self.open_session().get(full_url,
+                                               headers=headers,
+                                               timeout=timeout or self.timeout)
             if response.status_code == 401:
                 return None
             else:
                 response.raise_for_status()
-            data = response.json()
+            data = self.codec.loads(response.content)
+            if self.auth.__dict__.get("sessionExpires") != \
+                    data["sessionExpires"]:
+                self.auth.sessionExpires = data["sessionExpires"]
+                self.auth.save()
             return datetime.fromtimestamp(
                 float(data["sessionExpires"]) / 1000.0)
         except KeyError as e:
@@ -112,7 +427,83 @@ class RESTClient():
             else:
                 raise
 
-    def get_entity(self, entity, entity_ids, **kwargs):
+    def __fan_out(self, entity_ids, fetch, order_by_id=False):
+        """ Splits `entity_ids` in chunks of `ids_per_request`, fetches them
+            concurrently and merges every chunk's `data` into one response.
+        """
+        unique_ids = list(dict.fromkeys(entity_ids))
+        size = self.ids_per_request
+        chunks = [
+            unique_ids[i:i + size] for i in range(0, len(unique_ids), size)
+        ]
+        workers = max(1, min(self.fan_out_workers, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            responses = list(executor.map(self.__carry_scope(fetch), chunks))
+
+        merged = []
+        for response in responses:
+            data = response.get("data") or []
+            merged.extend(data if isinstance(data, list) else [data])
+        if order_by_id:
+            by_id = {record.get("id"): record for record in merged}
+            merged = [by_id[i] for i in entity_ids if i in by_id]
+
+        result = {**responses[0], "data": merged}
+        for counter in ("count", "total"):
+            if counter in result:
+                result[counter] = sum(r.get(counter, 0) for r in responses)
+        return result
+
+    def __cached_get_entity(self, cache, entity, entity_ids, **kwargs):
+        """ Serves `get_entity` from `cache`, only asking the API for the
+            ids it does not hold yet.
+        """
+        cache.sync(self)
+        fields = kwargs.get("fields")
+        ids = entity_ids if type(entity_ids) is list else [entity_ids]
+        found = {}
+        for entity_id in ids:
+            record = cache.get(entity, entity_id, fields)
+            if record is not None:
+                found[entity_id] = record
+
+        missing = [i for i in ids if i not in found]
+        if missing:
+            # Records changed by events applied during the read are not cached
+            generation = cache.generation
+            response = self.get_entity(entity, missing, _cached=False,
+                                       **kwargs)
+            data = response.get("data") or []
+            for record in data if isinstance(data, list) else [data]:
+                cache.put(entity, record, fields, generation)
+                found[record["id"]] = record
+
+        if type(entity_ids) is list:
+            return {"data": [found[i] for i in ids if i in found]}
+        return {"data": found.get(entity_ids)}
+
+    def warm_reference_cache(self, entities=None, fields="*"):
+        self.reference_cache.warm(self, entities, fields)
+
+    def __cache_for(self, entity):
+        for cache in (self.reference_cache, self.entity_cache):
+            if cache is not None and entity in cache:
+                return cache
+        return None
+
+    def get_entity(self, entity, entity_ids, _cached=True, **kwargs):
+        cache = self.__cache_for(entity) if _cached else None
+        if cache is not None:
+            return self.__cached_get_entity(cache, entity, entity_ids,
+                                            **kwargs)
+
+        if type(entity_ids) is list and len(
+                entity_ids) > self.ids_per_request:
+            return self.__fan_out(
+                entity_ids,
+                lambda chunk: self.get_entity(entity, chunk, **kwargs),
+                order_by_id=True)
+
         params = {a: v for a, v in kwargs.items()}
 
         if type(entity_ids) is int:
@@ -125,10 +516,23 @@ class RESTClient():
         base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
                                       entity_ids)
         full_url = f"{base_url}?{parse.urlencode(params)}"
-        response = self.safe_request("GET", full_url)
-        return response.json()
+        response = self.safe_request("GET", full_url, hedge=True)
+        return self.codec.loads(response.content)
+
+    def entity_loader(self, window=0.005, max_batch=None, max_workers=4):
+        """ Returns a `pyhorn.loader.EntityLoader` that coalesces single
+            record lookups into multi-id `get_entity` calls.
+        """
+        return pyhorn.loader.EntityLoader(self, window, max_batch,
+                                          max_workers)
 
     def get_tomany(self, entity, entity_ids, tomany, **kwargs):
+        if type(entity_ids) is list and len(
+                entity_ids) > self.ids_per_request:
+            return self.__fan_out(
+                entity_ids,
+                lambda chunk: self.get_tomany(entity, chunk, tomany, **kwargs))
+
         params = {a: v for a, v in kwargs.items()}
 
         if type(entity_ids) is int:
@@ -141,13 +545,35 @@ class RESTClient():
         base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
                                       entity_ids, tomany)
         full_url = f"{base_url}?{parse.urlencode(params)}"
-        response = self.safe_request("GET", full_url)
-        return response.json()
+        response = self.safe_request("GET", full_url, hedge=True)
+        return self.codec.loads(response.content)
+
+    def stream_tomany(self,
+                      entity,
+                      entity_ids,
+                      tomany,
+                      chunk_size=64 * 1024,
+                      **kwargs):
+        """ Like `get_tomany`, streaming the records; see `stream_query`. """
+        params = {a: v for a, v in kwargs.items()}
+
+        if type(entity_ids) is int:
+            entity_ids = str(entity_ids)
+        elif type(entity_ids) is list and type(entity_ids[0]) is int:
+            entity_ids = ','.join([str(i) for i in entity_ids])
+        else:
+            raise TypeError("entityIds should be of type int or list(int)")
+
+        base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
+                                      entity_ids, tomany)
+        full_url = f"{base_url}?{parse.urlencode(params)}"
+        response = self.safe_request("GET", full_url, stream=True)
+        return pyhorn.streaming.StreamedResponse(response, chunk_size)
 
     def create_entity(self, entity, data):
         base_url = self.__compose_url(self.auth.restUrl, "entity", entity)
         response = self.safe_request("PUT", base_url, json=data)
-        return response.json()
+        return self.codec.loads(response.content)
 
     def create_tomany(self, entity, entity_id, tomany, tomany_ids):
         if type(tomany_ids) is int:
@@ -160,7 +586,7 @@ class RESTClient():
         base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
                                       str(entity_id), tomany, tomany_ids)
         response = self.safe_request("PUT", base_url)
-        return response.json()
+        return self.codec.loads(response.content)
 
     def update_entity(self, entity, data):
         base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
@@ -168,7 +594,7 @@ class RESTClient():
 
         response = self.safe_request("POST", base_url, json=data)
 
-        return response.json()
+        return self.codec.loads(response.content)
 
     def delete_entity(self, entity, entity_id):
         if entity in _immutable_entities:
@@ -176,9 +602,19 @@ class RESTClient():
                 "The DELETE operation does not support this entity type.")
 
         base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
-                                      entity_id)
+                                      str(entity_id))
         response = self.safe_request("DELETE", base_url)
-        return response.json()
+        return self.codec.loads(response.content)
+
+    def bulk_write(self, operations, concurrency=8, max_retries=3):
+        """ Runs create/update/delete operations concurrently and yields
+            their results; see `pyhorn.bulk.bulk_write`.
+        """
+        return pyhorn.bulk.bulk_write(self,
+                                      operations,
+                                      concurrency=concurrency,
+                                      max_retries=max_retries,
+                                      immutable_entities=_immutable_entities)
 
     def delete_tomany(self, entity, entity_id, tomany, tomany_ids):
         if type(tomany_ids) is int:
@@ -189,33 +625,216 @@ class RESTClient():
             raise TypeError("entityIds should be of type int or list(int)")
 
         base_url = self.__compose_url(self.auth.restUrl, "entity", entity,
-                                      entity_id, tomany, tomany_ids)
+                                      str(entity_id), tomany, tomany_ids)
         response = self.safe_request("DELETE", base_url)
-        return response.json()
+        return self.codec.loads(response.content)
+
+    def sync_tomany(self,
+                    entity,
+                    entity_id,
+                    tomany,
+                    desired_ids,
+                    current_ids=None):
+        """ Adds and removes only the associations needed for `tomany` to
+            hold `desired_ids`; see `pyhorn.associations.sync_tomany`.
+        """
+        return pyhorn.associations.sync_tomany(self,
+                                               entity,
+                                               entity_id,
+                                               tomany,
+                                               desired_ids,
+                                               current_ids,
+                                               chunk_size=self.ids_per_request)
+
+    def sync_tomany_batch(self, entity, tomany, desired_by_id,
+                          concurrency=8):
+        """ `sync_tomany` across many parents concurrently; see
+            `pyhorn.associations.sync_tomany_batch`.
+        """
+        return pyhorn.associations.sync_tomany_batch(
+            self,
+            entity,
+            tomany,
+            desired_by_id,
+            concurrency=concurrency,
+            chunk_size=self.ids_per_request)
+
+    def __find(self, operation, entity, clause_key, clause, stream=False,
+               **kwargs):
+        params = {clause_key: clause, **{a: v for a, v in kwargs.items()}}
+        base_url = self.__compose_url(self.auth.restUrl, operation, entity)
+
+        if len(clause) >= 7500:
+            return self.safe_request("POST",
+                                     base_url,
+                                     json=params,
+                                     stream=stream)
+        full_url = f"{base_url}?{parse.urlencode(params)}"
+        return self.safe_request("GET",
+                                 full_url,
+                                 stream=stream,
+                                 hedge=not stream)
 
     def query(self, entity, where, *args, **kwargs):
-        params = {"where": where, **{a: v for a, v in kwargs.items()}}
-        base_url = self.__compose_url(self.auth.restUrl, "query", entity)
-
-        if len(where) >= 7500:
-            response = self.safe_request("POST", base_url, json=params)
-        else:
-            full_url = f"{base_url}?{parse.urlencode(params)}"
-            response = self.safe_request("GET", full_url)
-
-        return response.json()
+        response = self.__find("query", entity, "where", where, **kwargs)
+        return self.codec.loads(response.content)
 
     def search(self, entity, query, *args, **kwargs):
-        params = {"query": query, **{a: v for a, v in kwargs.items()}}
+        response = self.__find("search", entity, "query", query, **kwargs)
+        return self.codec.loads(response.content)
 
-        base_url = self.__compose_url(self.auth.restUrl, "search", entity)
-        if len(query) >= 7500:
-            response = self.safe_request("POST", base_url, json=params)
-        else:
-            full_url = f"{base_url}?{parse.urlencode(params)}"
-            response = self.safe_request("GET", full_url)
+    def stream_query(self, entity, where, chunk_size=64 * 1024, **kwargs):
+        """ Like `query`, but returns a `pyhorn.streaming.StreamedResponse`
+            that parses the records one at a time as the body arrives.
+        """
+        response = self.__find("query",
+                               entity,
+                               "where",
+                               where,
+                               stream=True,
+                               **kwargs)
+        return pyhorn.streaming.StreamedResponse(response, chunk_size)
+
+    def stream_search(self, entity, query, chunk_size=64 * 1024, **kwargs):
+        """ Like `search`, streaming the records; see `stream_query`. """
+        response = self.__find("search",
+                               entity,
+                               "query",
+                               query,
+                               stream=True,
+                               **kwargs)
+        return pyhorn.streaming.StreamedResponse(response, chunk_size)
+
+    def iter_query(self,
+                   entity,
+                   where,
+                   fields="id",
+                   page_size=MAX_RECORDS,
+                   keyset=False,
+                   prefetch=True,
+                   layout="dicts",
+                   **kwargs):
+        """ Yields every record matching `where`, fetching one page at a time.
+
+            With `keyset` the pages are walked by `id > last_seen` (sorted by
+            id) instead of growing offsets, which keeps deep pages as cheap as
+            the first one. With `prefetch` the next page is requested in the
+            background while the caller consumes the current one.
+
+            `layout` selects what is yielded: record dicts, compact namedtuple
+            rows ("rows"), or one `pyhorn.results.ColumnBatch` per page
+            ("columns").
+        """
+        if keyset:
+            fields = pyhorn.fields.with_id(fields)
+
+        def fetch_page(cursor):
+            if keyset:
+                clause = (where if cursor is None else
+                          f"({where}) AND id > {cursor}")
+                return self.query(entity,
+                                  clause,
+                                  fields=fields,
+                                  count=page_size,
+                                  sort="id",
+                                  **kwargs)
+            return self.query(entity,
+                              where,
+                              fields=fields,
+                              count=page_size,
+                              start=cursor,
+                              **kwargs)
+
+        shape = pyhorn.results.shape_pages(layout, fields)
+        yield from self.__iter_pages(fetch_page, keyset, prefetch, shape)
+
+    def iter_search(self,
+                    entity,
+                    query,
+                    fields="id",
+                    page_size=MAX_RECORDS,
+                    keyset=False,
+                    prefetch=True,
+                    layout="dicts",
+                    **kwargs):
+        """ Same as `iter_query`, for Lucene searches. Keyset pages are
+            requested with an exclusive `id:{last_seen TO *}` range.
+        """
+        if keyset:
+            fields = pyhorn.fields.with_id(fields)
+
+        def fetch_page(cursor):
+            if keyset:
+                clause = (query if cursor is None else
+                          f"({query}) AND id:{{{cursor} TO *}}")
+                return self.search(entity,
+                                   clause,
+                                   fields=fields,
+                                   count=page_size,
+                                   sort="id",
+                                   **kwargs)
+            return self.search(entity,
+                               query,
+                               fields=fields,
+                               count=page_size,
+                               start=cursor,
+                               **kwargs)
+
+        shape = pyhorn.results.shape_pages(layout, fields)
+        yield from self.__iter_pages(fetch_page, keyset, prefetch, shape)
+
+    def scan(self,
+             entity,
+             where="id>0",
+             fields="id",
+             workers=4,
+             shard_by="id",
+             ordered=False,
+             page_size=MAX_RECORDS):
+        """ Reads a whole entity concurrently; see `pyhorn.scan.scan`. """
+        return pyhorn.scan.scan(self,
+                                entity,
+                                where,
+                                fields,
+                                workers=workers,
+                                shard_by=shard_by,
+                                ordered=ordered,
+                                page_size=page_size)
+
+    def __iter_pages(self, fetch_page, keyset, prefetch, shape):
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        fetch_page = self.__carry_scope(fetch_page)
+
+        def schedule(cursor):
+            if executor is None:
+                return fetch_page(cursor)
+            return executor.submit(fetch_page, cursor)
+
+        def resolve(pending):
+            return pending if executor is None else pending.result()
 
-        return response.json()
+        try:
+            cursor = None if keyset else 0
+            pending = schedule(cursor)
+            while pending is not None:
+                response = resolve(pending)
+                batch = response.get("data") or []
+                count = response.get("count", len(batch))
+                total = response.get("total")
+                if keyset:
+                    cursor = batch[-1]["id"] if batch else None
+                    exhausted = total is not None and count >= total
+                else:
+                    cursor += count
+                    exhausted = total is not None and cursor >= total
+                pending = None
+                if count and not exhausted:
+                    pending = schedule(cursor)
+                del response
+                yield from shape(batch)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
 
     def capture(self, sub_id, max_events=100, **kwargs):
         params = {"maxEvents": max_events, **{k: v for k, v in kwargs.items()}}
@@ -224,8 +843,8 @@ class RESTClient():
                                       "subscription", sub_id)
         full_url = f"{base_url}?{parse.urlencode(params)}"
         response = self.safe_request("GET", full_url)
-        if int(response.headers["Content-Length"]) > 0:
-            return response.json()
+        if response.content.strip():
+            return self.codec.loads(response.content)
         else:
             return None
 
@@ -236,7 +855,7 @@ class RESTClient():
         base_url = self.__compose_url(self.auth.restUrl, "event",
                                       "subscription", sub_id, "lastRequestId")
         response = self.safe_request("GET", base_url)
-        return response.json()['result']
+        return self.codec.loads(response.content)['result']
 
     def subscribe(self, sub_id):
 
@@ -244,7 +863,7 @@ class RESTClient():
                                       "subscription", sub_id)
 
         response = self.safe_request("DELETE", full_url)
-        return response.json()
+        return self.codec.loads(response.content)
 
     def delete_subscribe(self, sub_id: AnyStr):
 
@@ -252,9 +871,15 @@ class RESTClient():
                                       "subscription", sub_id)
 
         response = self.safe_request("DELETE", base_url)
-        return response.json()
+        return self.codec.loads(response.content)
 
     def entity_file_attachment(self, entity, entity_ids, *args, **kwargs):
+        if type(entity_ids) is list and len(
+                entity_ids) > self.ids_per_request:
+            return self.__fan_out(
+                entity_ids, lambda chunk: self.entity_file_attachment(
+                    entity, chunk, **kwargs))
+
         params = {a: v for a, v in kwargs.items()}
 
         if type(entity_ids) is int:
@@ -270,42 +895,51 @@ class RESTClient():
 
         response = self.safe_request("GET", full_url)
 
-        return response.json()
+        return self.codec.loads(response.content)
 
-    def entity_edit_history(self, entity, where, *args, **kwargs):
-        params = {"where": where, **{a: v for a, v in kwargs.items()}}
-
-        base_url = self.__compose_url(
-            self.auth.restUrl,
-            "query",
-            f'{entity}EditHistory',
-        )
-        full_url = f"{base_url}?{parse.urlencode(params)}"
+    def download_file(self, entity, entity_id, file_id, path, **kwargs):
+        """ Streams an attachment to `path`; see
+            `pyhorn.files.download_file`.
+        """
+        return pyhorn.files.download_file(self, entity, entity_id, file_id,
+                                          path, **kwargs)
 
-        response = self.safe_request("GET", full_url)
+    def upload_file(self, entity, entity_id, stream, name, **kwargs):
+        """ Attaches the content of a file object to an entity; see
+            `pyhorn.files.upload_file`.
+        """
+        return pyhorn.files.upload_file(self, entity, entity_id, stream,
+                                        name, **kwargs)
 
-        return response.json()
+    def download_attachments(self, entity, entity_ids, directory, **kwargs):
+        return pyhorn.files.download_attachments(self, entity, entity_ids,
+                                                 directory, **kwargs)
 
-    def entity_edit_history_field_change(self, entity, where, *args, **kwargs):
-        params = {"where": where, **{a: v for a, v in kwargs.items()}}
+    def upload_attachments(self, entity, uploads, **kwargs):
+        return pyhorn.files.upload_attachments(self, entity, uploads,
+                                               **kwargs)
 
-        base_url = self.__compose_url(
-            self.auth.restUrl,
-            "query",
-            f'{entity}EditHistoryFieldChange',
-        )
-        full_url = f"{base_url}?{parse.urlencode(params)}"
+    def entity_edit_history(self, entity, where, *args, **kwargs):
+        return self.query(f'{entity}EditHistory', where, **kwargs)
 
-        response = self.safe_request("GET", full_url)
+    def entity_edit_history_field_change(self, entity, where, *args, **kwargs):
+        return self.query(f'{entity}EditHistoryFieldChange', where, **kwargs)
 
-        return response.json()
+    def history_extractor(self, entities, checkpoint=None, **kwargs):
+        """ Returns a `pyhorn.history.HistoryExtractor` reading the edit
+            history of `entities` incrementally.
+        """
+        return pyhorn.history.HistoryExtractor(self, entities, checkpoint,
+                                               **kwargs)
 
     def __enter__(self):
         _logger.debug("Starting REST Client...")
+        self.open_session()
         self.authenticate()
         _logger.debug("Authenticated!")
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_session()
         _logger.debug("Closed REST Client.")
         _logger.info(f"Exiting with: {exc_type}, {exc_val}, {exc_tb}")
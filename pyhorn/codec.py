@@ -0,0 +1,79 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import gzip
+import json
+import zlib
+
+__all__ = ['JSONCodec', 'default_codec', 'compress']
+
+
+class JSONCodec:
+    """ Encodes request bodies to and decodes response bodies from bytes.
+
+        `module` is "orjson", "ujson" or "json"; by default the fastest one
+        installed is used.
+    """
+    def __init__(self, module: str = None):
+        if module is None:
+            for module in ("orjson", "ujson", "json"):
+                try:
+                    __import__(module)
+                    break
+                except ImportError:
+                    continue
+        self.name = module
+        if module == "orjson":
+            import orjson
+            self.loads = orjson.loads
+            self.dumps = orjson.dumps
+        elif module == "ujson":
+            import ujson
+            self.loads = ujson.loads
+            self.dumps = lambda obj: ujson.dumps(
+                obj, ensure_ascii=False).encode("utf-8")
+        elif module == "json":
+            self.loads = json.loads
+            self.dumps = lambda obj: json.dumps(
+                obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        else:
+            raise ValueError(f"unsupported JSON module {module!r}")
+
+    def __repr__(self):
+        return f"JSONCodec({self.name!r})"
+
+
+_default = None
+
+
+def default_codec() -> JSONCodec:
+    """ Returns the codec shared by clients that were not given one. """
+    global _default
+    if _default is None:
+        _default = JSONCodec()
+    return _default
+
+
+def compress(body: bytes, encoding: str = "gzip", level: int = 6) -> bytes:
+    """ Compresses a request body for a `Content-Encoding` of `encoding`. """
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=level)
+    if encoding == "deflate":
+        return zlib.compress(body, level)
+    raise ValueError(f"unsupported content encoding {encoding!r}")
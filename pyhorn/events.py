@@ -0,0 +1,200 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import AnyStr
+
+__all__ = ['EventConsumer', 'FileCheckpoint']
+
+_logger = logging.getLogger("pyhorn")
+
+
+class FileCheckpoint:
+    """ Durable store of the last acknowledged requestId per subscription,
+        kept in a JSON file that is replaced atomically on every save.
+    """
+    def __init__(self, file_name: AnyStr):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+
+    def __read(self) -> dict:
+        try:
+            with open(self.file_name) as stream:
+                return json.load(stream)
+        except FileNotFoundError:
+            return {}
+
+    def load(self, sub_id: AnyStr) -> int:
+        with self.lock:
+            return self.__read().get(sub_id)
+
+    def save(self, sub_id: AnyStr, request_id: int):
+        with self.lock:
+            data = {**self.__read(), sub_id: request_id}
+            directory = os.path.dirname(os.path.abspath(self.file_name))
+            fd, temp_name = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "w") as stream:
+                json.dump(data, stream, indent=True)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(temp_name, self.file_name)
+
+
+class EventConsumer:
+    """ Keeps polling event subscriptions and hands their events to
+        `handler(sub_id, events)` on a pool of workers.
+
+        Each captured batch is split in chunks of `chunk_size` events that run
+        concurrently on `executor` (a thread pool of `workers` by default; a
+        process pool works too if `handler` can be pickled), with at most
+        `queue_size` chunks queued at once. Once every chunk of a batch is
+        handled its requestId is saved in `checkpoint`. When a handler fails
+        the batch is fetched again with `recapture` and redelivered, up to
+        `max_retries` times, so handlers should be idempotent.
+
+        On start, a batch that was captured but never acknowledged (because
+        the process died while handling it) is replayed before polling. When
+        any subscription fails for good, the whole consumer stops and `run`
+        raises the error.
+    """
+    def __init__(self,
+                 client,
+                 subscriptions,
+                 handler,
+                 checkpoint,
+                 workers=4,
+                 executor=None,
+                 max_events=500,
+                 chunk_size=100,
+                 queue_size=None,
+                 poll_interval=1.0,
+                 max_retries=3):
+        self.client = client
+        self.subscriptions = ([subscriptions] if isinstance(
+            subscriptions, str) else list(subscriptions))
+        self.handler = handler
+        self.checkpoint = checkpoint
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers)
+        self.max_events = max_events
+        self.chunk_size = chunk_size
+        self.slots = threading.BoundedSemaphore(queue_size or workers * 2)
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.stopping = threading.Event()
+        self.threads = []
+        self.errors = []
+
+    def __dispatch(self, sub_id, events) -> bool:
+        futures = []
+        for i in range(0, len(events), self.chunk_size):
+            self.slots.acquire()
+            future = self.executor.submit(self.handler, sub_id,
+                                          events[i:i + self.chunk_size])
+            future.add_done_callback(lambda _: self.slots.release())
+            futures.append(future)
+        wait(futures)
+        failures = [f.exception() for f in futures if f.exception()]
+        for error in failures:
+            _logger.error(f"Handler failed for {sub_id}: {error!r}")
+        return not failures
+
+    def __deliver(self, sub_id, batch):
+        request_id = batch["requestId"]
+        for attempt in range(self.max_retries + 1):
+            if self.__dispatch(sub_id, batch.get("events") or []):
+                self.checkpoint.save(sub_id, request_id)
+                return
+            if attempt < self.max_retries:
+                batch = self.client.recapture(sub_id, request_id) or batch
+        raise RuntimeError(f"Events of request {request_id} on {sub_id} "
+                           f"failed after {self.max_retries} retries.")
+
+    def recover(self, sub_id):
+        """ Redelivers the last captured batch if it was never acknowledged.
+            Without a checkpoint yet, any batch already captured counts as
+            unacknowledged, so the first batch of a crashed run is replayed.
+        """
+        acknowledged = self.checkpoint.load(sub_id)
+        last_id = self.client.get_last_capture_id(sub_id)
+        if last_id and last_id != acknowledged:
+            batch = self.client.recapture(sub_id, last_id)
+            if batch:
+                self.__deliver(sub_id, batch)
+
+    def poll_once(self, sub_id) -> int:
+        """ Captures and handles one batch, returning how many events it had.
+        """
+        batch = self.client.capture(sub_id, self.max_events)
+        if not batch:
+            return 0
+        self.__deliver(sub_id, batch)
+        return len(batch.get("events") or [])
+
+    def __poll(self, sub_id):
+        try:
+            self.recover(sub_id)
+            while not self.stopping.is_set():
+                if self.poll_once(sub_id) < self.max_events:
+                    self.stopping.wait(self.poll_interval)
+        except Exception as e:
+            _logger.error(f"Stopped consuming {sub_id}: {e!r}")
+            self.errors.append(e)
+            # Stop every subscription so `run` raises instead of carrying on
+            # with this one silently dead
+            self.stop()
+
+    def start(self):
+        for sub_id in self.subscriptions:
+            thread = threading.Thread(target=self.__poll,
+                                      args=(sub_id, ),
+                                      name=f"pyhorn-events-{sub_id}",
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.stopping.set()
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+        self.executor.shutdown(wait=True)
+
+    def run(self):
+        """ Consumes until `stop` is called from another thread, and raises
+            the first error that stopped a subscription.
+        """
+        self.start()
+        self.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        self.join()
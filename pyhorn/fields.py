@@ -0,0 +1,55 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from typing import List
+
+__all__ = ['field_names', 'with_id']
+
+
+def field_names(fields) -> List[str]:
+    """ Splits a `fields` selection into its top-level field names, keeping
+        nested selections such as `owner(id,name)` in one piece.
+    """
+    if not isinstance(fields, str):
+        return [str(f).strip() for f in fields]
+
+    names, depth, current = [], 0, []
+    for char in fields:
+        if char == "," and depth == 0:
+            names.append("".join(current).strip())
+            current = []
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        current.append(char)
+    names.append("".join(current).strip())
+    return [n for n in names if n]
+
+
+def with_id(fields) -> str:
+    """ Returns `fields` as a selection string that is guaranteed to include
+        `id`, which keyset pagination and id sharding rely on.
+    """
+    names = field_names(fields)
+    if "*" not in names and "id" not in names:
+        names.insert(0, "id")
+    return ",".join(names)
@@ -0,0 +1,273 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import secrets
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+__all__ = [
+    'FileTransfer', 'download_file', 'upload_file', 'download_attachments',
+    'upload_attachments'
+]
+
+FileTransfer = namedtuple(
+    "FileTransfer",
+    ["entity", "entity_id", "file_id", "path", "bytes", "error"])
+FileTransfer.__doc__ = """ Outcome of one file of a bulk transfer. `bytes`
+    counts what was transferred by this call, so a skipped or resumed file
+    reports less than its size.
+"""
+
+CHUNK_SIZE = 1 << 20
+
+
+class _MultipartBody:
+    """ A `multipart/form-data` body holding one file, read from `stream`
+        block by block as it is sent. It is seekable, so a retried request
+        starts over from the beginning.
+    """
+    def __init__(self, stream, name, content_type):
+        boundary = secrets.token_hex(16)
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.__head = (f"--{boundary}\r\n"
+                       f"Content-Disposition: form-data; name=\"file\"; "
+                       f"filename=\"{name}\"\r\n"
+                       f"Content-Type: {content_type}\r\n\r\n").encode()
+        self.__tail = f"\r\n--{boundary}--\r\n".encode()
+        self.__stream = stream
+        self.__start = stream.tell()
+        self.__size = stream.seek(0, os.SEEK_END) - self.__start
+        stream.seek(self.__start)
+        self.__length = len(self.__head) + self.__size + len(self.__tail)
+        self.__position = 0
+
+    def __len__(self):
+        return self.__length
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.__position
+        elif whence == os.SEEK_END:
+            offset += self.__length
+        self.__position = max(0, min(offset, self.__length))
+        file_offset = min(max(self.__position - len(self.__head), 0),
+                          self.__size)
+        self.__stream.seek(self.__start + file_offset)
+        return self.__position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.__length - self.__position
+        head, tail = len(self.__head), len(self.__head) + self.__size
+        chunks = []
+        while size > 0 and self.__position < self.__length:
+            position = self.__position
+            if position < head:
+                data = self.__head[position:position + size]
+            elif position < tail:
+                data = self.__stream.read(min(size, tail - position))
+                if not data:
+                    raise IOError("upload stream ended before its size")
+            else:
+                data = self.__tail[position - tail:position - tail + size]
+            chunks.append(data)
+            self.__position += len(data)
+            size -= len(data)
+        return b"".join(chunks)
+
+
+def download_file(client,
+                  entity,
+                  entity_id,
+                  file_id,
+                  path,
+                  chunk_size=CHUNK_SIZE,
+                  resume=True) -> int:
+    """ Streams the content of an attachment to `path`, `chunk_size` bytes
+        at a time, and returns the number of bytes received.
+
+        The file is written to `path + ".part"` and renamed once complete.
+        With `resume`, a `.part` file left by an interrupted download is
+        continued with a Range request; if the server ignores the range the
+        download starts over.
+    """
+    partial = f"{path}.part"
+    offset = os.path.getsize(partial) if resume and \
+        os.path.exists(partial) else 0
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    url = "/".join([
+        client.auth.restUrl.rstrip("/"), "file", entity,
+        str(entity_id),
+        str(file_id), "raw"
+    ])
+    try:
+        response = client.safe_request("GET",
+                                       url,
+                                       headers=headers,
+                                       stream=True)
+    except requests.HTTPError as e:
+        if offset and e.response is not None and \
+                e.response.status_code == 416:
+            os.replace(partial, path)
+            return 0
+        raise
+
+    received = 0
+    with response:
+        mode = "ab" if offset and response.status_code == 206 else "wb"
+        with open(partial, mode) as stream:
+            for chunk in response.iter_content(chunk_size):
+                stream.write(chunk)
+                received += len(chunk)
+    os.replace(partial, path)
+    return received
+
+
+def upload_file(client,
+                entity,
+                entity_id,
+                stream,
+                name,
+                content_type="application/octet-stream",
+                file_type="SAMPLE",
+                external_id="portfolio",
+                **kwargs) -> dict:
+    """ Attaches the content of the binary file object `stream` to an
+        entity, sending it as it is read. `stream` must be seekable.
+    """
+    params = {"externalID": external_id, "fileType": file_type, **kwargs}
+    url = "/".join([
+        client.auth.restUrl.rstrip("/"), "file", entity,
+        str(entity_id), "raw"
+    ])
+    body = _MultipartBody(stream, os.path.basename(name), content_type)
+    response = client.safe_request("PUT",
+                                   url,
+                                   params=params,
+                                   data=body,
+                                   headers={"Content-Type": body.content_type})
+    return client.codec.loads(response.content)
+
+
+def _transfers(jobs, workers):
+    """ Runs the callables yielded by `jobs` on `workers` threads. A job
+        returns either a FileTransfer, which is yielded, or a list of further
+        jobs, which run before any new job is taken from `jobs`.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers)
+    in_flight, follow_ups = set(), deque()
+    jobs = iter(jobs)
+    try:
+        while True:
+            while len(in_flight) < workers:
+                job = follow_ups.popleft() if follow_ups else next(jobs, None)
+                if job is None:
+                    break
+                in_flight.add(executor.submit(job))
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if isinstance(result, FileTransfer):
+                    yield result
+                else:
+                    follow_ups.extend(result)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def download_attachments(client,
+                         entity,
+                         entity_ids,
+                         directory,
+                         workers=8,
+                         chunk_size=CHUNK_SIZE,
+                         resume=True,
+                         accept=None):
+    """ Downloads the attachments of every entity in `entity_ids` to
+        `directory/<entity_id>/<file id>_<name>`, with `workers` concurrent
+        transfers, and yields a `FileTransfer` for each file as it completes.
+
+        `accept(attachment)` can filter the attachment metadata. With
+        `resume`, files already on disk with their full size are skipped and
+        partial ones are continued.
+    """
+    def download(entity_id, attachment):
+        file_id = attachment["id"]
+        name = os.path.basename(attachment.get("name") or str(file_id))
+        path = os.path.join(directory, str(entity_id), f"{file_id}_{name}")
+        try:
+            size = attachment.get("fileSize")
+            if resume and size is not None and os.path.exists(path) and \
+                    os.path.getsize(path) == size:
+                return FileTransfer(entity, entity_id, file_id, path, 0, None)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            received = download_file(client, entity, entity_id, file_id,
+                                     path, chunk_size, resume)
+            return FileTransfer(entity, entity_id, file_id, path, received,
+                                None)
+        except Exception as e:
+            return FileTransfer(entity, entity_id, file_id, path, 0, e)
+
+    def listing(entity_id):
+        def run():
+            try:
+                response = client.entity_file_attachment(entity, entity_id)
+            except Exception as e:
+                return FileTransfer(entity, entity_id, None, None, 0, e)
+            attachments = response.get("data") or []
+            return [
+                lambda a=a: download(entity_id, a) for a in attachments
+                if accept is None or accept(a)
+            ]
+
+        return run
+
+    return _transfers((listing(entity_id) for entity_id in entity_ids),
+                      workers)
+
+
+def upload_attachments(client, entity, uploads, workers=8, **kwargs):
+    """ Uploads `(entity_id, path)` pairs with `workers` concurrent
+        transfers, yielding a `FileTransfer` for each one as it completes;
+        its `file_id` is the id of the new attachment. `kwargs` are passed to
+        `upload_file`.
+    """
+    def upload(entity_id, path):
+        try:
+            with open(path, "rb") as stream:
+                response = upload_file(client, entity, entity_id, stream,
+                                       path, **kwargs)
+            return FileTransfer(entity, entity_id, response.get("fileId"),
+                                path, os.path.getsize(path), None)
+        except Exception as e:
+            return FileTransfer(entity, entity_id, None, path, 0, e)
+
+    return _transfers(
+        (lambda e=entity_id, p=path: upload(e, p)
+         for entity_id, path in uploads), workers)
@@ -0,0 +1,187 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pyhorn.scheduler
+
+__all__ = ['Hedger']
+
+
+def _discard(future):
+    """ Releases the connection of a request whose answer lost the race. """
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class Hedger:
+    """ Sends a second copy of a slow request and keeps whichever answers
+        first.
+
+        The hedge fires once the first copy has been waiting longer than the
+        `percentile`-th latency of the last `window` requests to the same
+        endpoint (and at least `min_delay`); nothing is hedged before
+        `min_samples` latencies are known. Every request earns
+        `max_fraction` of a hedge, with up to `burst` saved, so hedges stay
+        within that fraction of the traffic. On a `RESTClient`, the extra
+        copy waits for the scheduler's rate limit and concurrency slots like
+        any other request.
+
+        Both copies run on the hedger's pool of `max_workers` threads, which
+        by default is sized when first used to twice the `pool_maxsize` of
+        the client sending through it. Callers beyond that wait for a
+        thread; the wait is not counted as latency and such requests are not
+        hedged, as the copy would queue as well. A request already on the
+        wire cannot be interrupted: the losing copy runs to completion on
+        the pool and its response is closed.
+    """
+    def __init__(self,
+                 percentile: float = 95,
+                 max_fraction: float = 0.05,
+                 burst: float = 10,
+                 window: int = 1000,
+                 min_samples: int = 50,
+                 min_delay: float = 0.01,
+                 max_workers: int = None):
+        self.percentile = percentile
+        self.max_fraction = max_fraction
+        self.burst = burst
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_workers = max_workers
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0}
+        self.__budget = 0.0
+        self.__samples = {}
+        self.__observed = {}
+        self.__delays = {}
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    def delay(self, key) -> float:
+        """ Returns how long a request to `key` waits before it is hedged,
+            or None while too few latencies are known.
+        """
+        return self.__delays.get(key)
+
+    def observe(self, key, elapsed: float):
+        with self.__lock:
+            samples = self.__samples.get(key)
+            if samples is None:
+                samples = self.__samples[key] = deque(maxlen=self.window)
+            samples.append(elapsed)
+            observed = self.__observed[key] = self.__observed.get(key, 0) + 1
+            if len(samples) < self.min_samples or \
+                    (key in self.__delays and observed % 16):
+                return
+            ordered = sorted(samples)
+            rank = int(self.percentile / 100.0 * len(ordered))
+            self.__delays[key] = max(self.min_delay,
+                                     ordered[min(len(ordered) - 1, rank)])
+
+    def __take_hedge(self) -> bool:
+        with self.__lock:
+            if self.__budget < 1:
+                return False
+            self.__budget -= 1
+            self.stats["hedges"] += 1
+            return True
+
+    def __pool(self, workers):
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers or workers or 32)
+            return self.__executor
+
+    def run(self,
+            key,
+            send,
+            deadline=None,
+            hedge_send=None,
+            workers=None):
+        """ Calls `send()`, hedging it with `hedge_send()` (by default
+            `send()` again) when it is slow for `key`, and returns the first
+            response. `deadline` is a `time.monotonic()` instant after which
+            `DeadlineExceeded` is raised instead of waiting. `workers` sizes
+            the pool when `max_workers` is not set.
+        """
+        executor = self.__pool(workers)
+        with self.__lock:
+            self.stats["requests"] += 1
+            self.__budget = min(self.burst, self.__budget + self.max_fraction)
+        started = []
+
+        def timed():
+            started.append(time.monotonic())
+            try:
+                return send()
+            finally:
+                self.observe(key, time.monotonic() - started[0])
+
+        primary = executor.submit(timed)
+        pending = {primary}
+
+        delay = self.delay(key)
+        while delay is not None:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            # Hedge `delay` after the primary actually started, not while it
+            # waits for a thread
+            timeout = delay if not started else started[0] + delay - now
+            if deadline is not None:
+                timeout = min(timeout, deadline - now)
+            done, _ = wait(pending, timeout=max(0.0, timeout))
+            if done:
+                break
+            if started and time.monotonic() - started[0] >= delay:
+                if self.__take_hedge():
+                    pending.add(executor.submit(hedge_send or send))
+                break
+
+        try:
+            while pending:
+                timeout = None if deadline is None else max(
+                    0.0, deadline - time.monotonic())
+                done, pending = wait(pending,
+                                     timeout=timeout,
+                                     return_when=FIRST_COMPLETED)
+                if not done:
+                    raise pyhorn.scheduler.DeadlineExceeded(
+                        "request deadline exceeded")
+                for future in done:
+                    if future.exception() is None or not pending:
+                        if future is not primary:
+                            with self.__lock:
+                                self.stats["hedge_wins"] += 1
+                        for other in done - {future}:
+                            _discard(other)
+                        return future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+                future.add_done_callback(_discard)
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,154 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+import pyhorn.fields
+
+__all__ = ['EntityLoader']
+
+
+class _Batch:
+    def __init__(self, key):
+        self.key = key
+        self.futures = {}
+
+
+class EntityLoader:
+    """ Coalesces single-record `get_entity` lookups.
+
+        Lookups for the same entity, fields and parameters made within
+        `window` seconds of each other are sent as one multi-id call (at most
+        `max_batch` ids, by default the client's `ids_per_request`), and a
+        lookup for an id that is already in flight waits for that request
+        instead of sending another.
+    """
+    def __init__(self, client, window=0.005, max_batch=None, max_workers=4):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch or client.ids_per_request
+        self.stats = {"loads": 0, "coalesced": 0, "requests": 0}
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__in_flight = {}
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, entity, entity_id, fields="id", **kwargs) -> Future:
+        """ Schedules the lookup of one record, returning a future of the
+            record, or of None when it does not exist.
+        """
+        fields = pyhorn.fields.with_id(fields)
+        key = (entity, fields, tuple(sorted(kwargs.items())))
+        with self.__lock:
+            self.stats["loads"] += 1
+            future = self.__in_flight.get((key, entity_id))
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return future
+            future = Future()
+            self.__in_flight[(key, entity_id)] = future
+            batch = self.__pending.get(key)
+            if batch is None:
+                batch = self.__pending[key] = _Batch(key)
+                if self.window > 0:
+                    timer = threading.Timer(self.window, self.__flush,
+                                            (batch, ))
+                    timer.daemon = True
+                    timer.start()
+            batch.futures[entity_id] = future
+            full = len(batch.futures) >= self.max_batch or self.window <= 0
+            if full:
+                del self.__pending[key]
+        if full:
+            self.__executor.submit(self.__dispatch, batch)
+        return future
+
+    def load(self, entity, entity_id, fields="id", **kwargs):
+        """ Returns one record, or None when it does not exist. """
+        return self.submit(entity, entity_id, fields, **kwargs).result()
+
+    def load_many(self, entity, entity_ids, fields="id", **kwargs) -> list:
+        """ Returns the records of `entity_ids` in order, None for the ones
+            that do not exist.
+        """
+        futures = [
+            self.submit(entity, entity_id, fields, **kwargs)
+            for entity_id in entity_ids
+        ]
+        return [future.result() for future in futures]
+
+    def flush(self):
+        """ Sends every pending batch without waiting for its window. """
+        with self.__lock:
+            batches = list(self.__pending.values())
+            self.__pending.clear()
+        for batch in batches:
+            self.__executor.submit(self.__dispatch, batch)
+
+    def close(self):
+        self.flush()
+        self.__executor.shutdown(wait=True)
+
+    def __flush(self, batch):
+        with self.__lock:
+            if self.__pending.get(batch.key) is not batch:
+                return
+            del self.__pending[batch.key]
+        self.__executor.submit(self.__dispatch, batch)
+
+    def __dispatch(self, batch):
+        entity, fields, params = batch.key
+        with self.__lock:
+            self.stats["requests"] += 1
+        try:
+            response = self.client.get_entity(entity,
+                                              list(batch.futures),
+                                              fields=fields,
+                                              **dict(params))
+            data = response.get("data") or []
+            records = {
+                record["id"]: record
+                for record in (data if isinstance(data, list) else [data])
+            }
+            error = None
+        except requests.HTTPError as e:
+            # A batch of one id is read from entity/X/<id>, a 404 when the
+            # record does not exist
+            missing = e.response is not None and \
+                e.response.status_code == 404
+            records, error = {}, None if missing else e
+        except Exception as e:
+            records, error = {}, e
+        with self.__lock:
+            for entity_id in batch.futures:
+                self.__in_flight.pop((batch.key, entity_id), None)
+        for entity_id, future in batch.futures.items():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(records.get(entity_id))
@@ -0,0 +1,153 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import bisect
+import threading
+from collections import namedtuple
+
+__all__ = ['Histogram', 'Metrics', 'RequestEvent']
+
+RequestEvent = namedtuple("RequestEvent", [
+    "method", "endpoint", "status", "elapsed", "bytes_out", "bytes_in",
+    "error"
+])
+
+_latency_buckets = [
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0,
+    7.5, 10.0, 30.0, 60.0
+]
+
+
+class Histogram:
+    """ Fixed-bucket latency histogram, in seconds. """
+    def __init__(self, buckets=_latency_buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        """ Upper bound of the bucket holding the `p`-th percentile. """
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": dict(zip([*self.buckets, "+Inf"], self.counts))
+        }
+
+
+class Metrics:
+    """ Request instrumentation for a `RESTClient`.
+
+        Keeps per-endpoint latency histograms, bytes in/out, counters (such
+        as retries and re-authentications) and the number of requests in
+        flight. Hooks registered with `add_hook` receive a `RequestEvent` for
+        every finished request; nothing is built for them when none is
+        registered. Endpoints are grouped by operation and entity, e.g.
+        "GET query/Candidate", so ids never end up in metric names.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hooks = []
+        self.latency = {}
+        self.counters = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.in_flight = 0
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def increment(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finished(self,
+                 method,
+                 endpoint,
+                 status,
+                 elapsed,
+                 bytes_out=0,
+                 bytes_in=0,
+                 error=None):
+        name = f"{method} {endpoint}"
+        with self.lock:
+            self.in_flight -= 1
+            self.bytes_out += bytes_out
+            self.bytes_in += bytes_in
+            histogram = self.latency.get(name)
+            if histogram is None:
+                histogram = self.latency[name] = Histogram()
+            histogram.observe(elapsed)
+            outcome = "errors" if error is not None or (
+                status or 0) >= 400 else "requests"
+            self.counters[outcome] = self.counters.get(outcome, 0) + 1
+        if self.hooks:
+            event = RequestEvent(method, endpoint, status, elapsed, bytes_out,
+                                 bytes_in, error)
+            for hook in list(self.hooks):
+                hook(event)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "in_flight": self.in_flight,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "counters": dict(self.counters),
+                "latency": {
+                    name: histogram.snapshot()
+                    for name, histogram in self.latency.items()
+                }
+            }
+
+    def reset(self):
+        with self.lock:
+            self.latency.clear()
+            self.counters.clear()
+            self.bytes_in = self.bytes_out = 0
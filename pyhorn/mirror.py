@@ -0,0 +1,262 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import sqlite3
+import threading
+import time
+from typing import AnyStr
+
+import pyhorn.fields
+
+__all__ = ['Mirror']
+
+
+def _quote(name: AnyStr) -> AnyStr:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class Mirror:
+    """ Local SQLite copy of selected entities, kept up to date from the API.
+
+        Each tracked entity gets a table with one column per requested field
+        (nested values are stored as JSON) plus the full record, indexed on id
+        and on the watermark field. The first `sync` loads the whole entity;
+        later ones only read records whose `watermark` (`dateLastModified` by
+        default) is at or past the newest value the API held when the
+        previous sync started, and, when a subscription is given, drop
+        records reported DELETED by its events.
+
+        `get` and `query` answer from the local database only, with `query`
+        taking a SQL where clause over the field columns, which covers the
+        simple Bullhorn-style clauses such as `status = 'Open' AND id > 10`.
+    """
+    def __init__(self, db_name: AnyStr, client=None):
+        self.client = client
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(db_name, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE IF NOT EXISTS _mirror_state ("
+                        "entity TEXT PRIMARY KEY, fields TEXT, "
+                        "watermark_field TEXT, sub_id TEXT, "
+                        "watermark INTEGER, last_sync REAL)")
+        self.db.commit()
+
+    def track(self,
+              entity,
+              fields,
+              watermark="dateLastModified",
+              sub_id=None):
+        """ Starts mirroring `entity`. `fields` must be explicit (not `*`)
+            because they become the table's columns.
+        """
+        names = pyhorn.fields.field_names(
+            pyhorn.fields.with_id(f"{watermark},{fields}"))
+        if "*" in names:
+            raise ValueError("Mirrored entities need an explicit field list")
+        columns = list(dict.fromkeys(n.split("(")[0].strip() for n in names))
+        table = _quote(entity)
+        with self.lock:
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                            "id INTEGER PRIMARY KEY, " + ", ".join(
+                                _quote(c)
+                                for c in columns if c != "id") +
+                            ", _record TEXT)")
+            existing = {
+                row["name"]
+                for row in self.db.execute(f"PRAGMA table_info({table})")
+            }
+            for column in columns:
+                if column not in existing:
+                    self.db.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {_quote(column)}")
+            self.db.execute(
+                f"CREATE INDEX IF NOT EXISTS {_quote(entity + '_watermark')} "
+                f"ON {table} ({_quote(watermark)})")
+            self.db.execute(
+                "INSERT INTO _mirror_state (entity, fields, watermark_field, "
+                "sub_id) VALUES (?, ?, ?, ?) ON CONFLICT (entity) DO UPDATE "
+                "SET fields = excluded.fields, "
+                "watermark_field = excluded.watermark_field, "
+                "sub_id = excluded.sub_id",
+                (entity, ",".join(names), watermark, sub_id))
+            self.db.commit()
+
+    def __columns(self, entity):
+        return [
+            row["name"] for row in self.db.execute(
+                f"PRAGMA table_info({_quote(entity)})")
+            if row["name"] != "_record"
+        ]
+
+    def __upsert(self, entity, columns, records):
+        table = _quote(entity)
+        statement = (f"INSERT OR REPLACE INTO {table} (" +
+                     ", ".join(_quote(c) for c in columns) +
+                     ", _record) VALUES (" + ", ".join("?" * len(columns)) +
+                     ", ?)")
+        with self.lock:
+            self.db.executemany(statement, [
+                [_column_value(r.get(c)) for c in columns] + [json.dumps(r)]
+                for r in records
+            ])
+
+    def sync(self, entity=None, workers=4, page_size=500) -> dict:
+        """ Brings `entity` (every tracked entity by default) up to date and
+            returns how many records were written and deleted, per entity
+            when syncing all of them.
+
+            Each subscription involved is read once, and its DELETED events
+            are applied to every tracked entity that shares it, since
+            captured events are gone from the subscription.
+        """
+        with self.lock:
+            states = {
+                row["entity"]: row
+                for row in self.db.execute("SELECT * FROM _mirror_state")
+            }
+        if entity is not None and entity not in states:
+            raise KeyError(f"{entity} is not mirrored; call track() first")
+        entities = list(states) if entity is None else [entity]
+
+        results = {}
+        for name in entities:
+            written = self.__load(states[name], workers, page_size)
+            results[name] = {"written": written, "deleted": 0}
+
+        for sub_id in {states[n]["sub_id"] for n in entities} - {None}:
+            tracked = [n for n, st in states.items() if st["sub_id"] == sub_id]
+            for name, deleted in self.__apply_deletes(tracked,
+                                                      sub_id).items():
+                results.setdefault(name, {"written": 0, "deleted": 0})
+                results[name]["deleted"] += deleted
+        return results if entity is None else results[entity]
+
+    def __load(self, state, workers, page_size) -> int:
+        entity = state["entity"]
+        with self.lock:
+            columns = self.__columns(entity)
+        watermark_field, watermark = state["watermark_field"], \
+            state["watermark"]
+        # Records changed while this sync reads are at or past the newest
+        # value seen before it starts, so the next delta picks them up
+        newest = self.__newest(entity, watermark_field)
+        if newest is None:
+            newest = watermark
+        if watermark is None:
+            records = self.client.scan(entity,
+                                       "id>0",
+                                       state["fields"],
+                                       workers=workers,
+                                       page_size=page_size)
+        else:
+            records = self.client.iter_query(
+                entity,
+                f"{watermark_field} >= {watermark}",
+                fields=state["fields"],
+                page_size=page_size,
+                keyset=True)
+
+        written, batch = 0, []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= page_size:
+                self.__upsert(entity, columns, batch)
+                written, batch = written + len(batch), []
+        self.__upsert(entity, columns, batch)
+        written += len(batch)
+
+        with self.lock:
+            self.db.execute(
+                "UPDATE _mirror_state SET watermark = ?, last_sync = ? "
+                "WHERE entity = ?", (newest, time.time(), entity))
+            self.db.commit()
+        return written
+
+    def __newest(self, entity, watermark_field):
+        response = self.client.query(entity,
+                                     "id>0",
+                                     fields=f"id,{watermark_field}",
+                                     count=1,
+                                     sort=f"-{watermark_field}")
+        data = response.get("data") or []
+        return data[0].get(watermark_field) if data else None
+
+    def __apply_deletes(self, entities, sub_id, max_events=500) -> dict:
+        deleted = dict.fromkeys(entities, 0)
+        while True:
+            response = self.client.capture(sub_id, max_events)
+            events = (response or {}).get("events") or []
+            for name in entities:
+                ids = [(e["entityId"], ) for e in events
+                       if e.get("entityName") == name
+                       and e.get("entityEventType") == "DELETED"]
+                if ids:
+                    with self.lock:
+                        cursor = self.db.executemany(
+                            f"DELETE FROM {_quote(name)} WHERE id = ?", ids)
+                        deleted[name] += cursor.rowcount
+                        self.db.commit()
+            if len(events) < max_events:
+                return deleted
+
+    def __record(self, row, fields):
+        record = json.loads(row["_record"])
+        if fields is None:
+            return record
+        names = [
+            n.split("(")[0].strip()
+            for n in pyhorn.fields.field_names(fields)
+        ]
+        return {k: record.get(k) for k in names}
+
+    def get(self, entity, entity_id, fields=None):
+        with self.lock:
+            row = self.db.execute(
+                f"SELECT _record FROM {_quote(entity)} WHERE id = ?",
+                (entity_id, )).fetchone()
+        return None if row is None else self.__record(row, fields)
+
+    def query(self,
+              entity,
+              where="1=1",
+              fields=None,
+              params=(),
+              order_by="id",
+              limit=None):
+        """ Returns the mirrored records matching the SQL `where` clause,
+            which can use `?` placeholders bound to `params`.
+        """
+        statement = (f"SELECT _record FROM {_quote(entity)} WHERE {where} "
+                     f"ORDER BY {order_by}")
+        if limit is not None:
+            statement += f" LIMIT {int(limit)}"
+        with self.lock:
+            rows = self.db.execute(statement, params).fetchall()
+        return [self.__record(row, fields) for row in rows]
+
+    def close(self):
+        self.db.close()
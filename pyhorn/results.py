@@ -0,0 +1,146 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from array import array
+from collections import namedtuple
+
+import pyhorn.fields
+
+__all__ = ['RowFactory', 'ColumnBatch', 'shape_pages']
+
+
+def _base_names(fields):
+    """ Top-level names of a field selection, without nested selections:
+        `owner(id,name)` becomes `owner`.
+    """
+    return [
+        name.split("(")[0].strip()
+        for name in pyhorn.fields.field_names(fields)
+    ]
+
+
+class RowFactory:
+    """ Turns record dicts into compact namedtuple rows, whose type is
+        generated once from the requested `fields` (or from the first record's
+        keys when they are `*`). Missing values are None.
+    """
+    def __init__(self, fields, name="Record"):
+        names = _base_names(fields)
+        self.name = name
+        self.keys = None
+        self.row_type = None
+        if "*" not in names:
+            self.__make(names)
+
+    def __make(self, keys):
+        self.keys = keys
+        self.row_type = namedtuple(self.name, keys, rename=True)
+
+    def __call__(self, record: dict):
+        if self.row_type is None:
+            self.__make(list(record))
+        return self.row_type._make([record.get(k) for k in self.keys])
+
+    def rows(self, records):
+        for record in records:
+            yield self(record)
+
+
+class ColumnBatch:
+    """ A page of records stored column by column.
+
+        Columns whose values are all integers (ids, epoch-millisecond dates)
+        are packed in `array('q')`, float columns in `array('d')`; any other
+        column is a list. A packed column falls back to a list as soon as a
+        value that does not fit shows up.
+    """
+    def __init__(self, fields):
+        names = _base_names(fields)
+        self.names = None if "*" in names else names
+        self.columns = {}
+        self.length = 0
+
+    @classmethod
+    def from_records(cls, records, fields):
+        batch = cls(fields)
+        batch.extend(records)
+        return batch
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __add(self, name, value):
+        column = self.columns.get(name)
+        if column is None:
+            if isinstance(value, int) and not isinstance(value, bool):
+                column = array("q", [0] * self.length)
+            elif isinstance(value, float):
+                column = array("d", [0.0] * self.length)
+            else:
+                column = [None] * self.length
+            self.columns[name] = column
+        if isinstance(column, array):
+            try:
+                if column.typecode == "q" and (isinstance(value, bool) or
+                                               not isinstance(value, int)):
+                    raise TypeError
+                if column.typecode == "d" and not isinstance(
+                        value, (int, float)):
+                    raise TypeError
+                column.append(value)
+                return
+            except (TypeError, OverflowError):
+                column = self.columns[name] = list(column)
+        column.append(value)
+
+    def append(self, record: dict):
+        if self.names is None:
+            self.names = list(record)
+        for name in self.names:
+            self.__add(name, record.get(name))
+        self.length += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def rows(self):
+        """ Iterates over the batch as namedtuple rows. """
+        factory = RowFactory(self.names or [])
+        columns = [self.columns[name] for name in self.names or []]
+        for values in zip(*columns):
+            yield factory.row_type._make(values)
+
+
+def shape_pages(layout, fields):
+    """ Returns a function converting a page of record dicts into what the
+        `layout` ("dicts", "rows" or "columns") asks for.
+    """
+    if layout == "dicts":
+        return lambda batch: batch
+    if layout == "rows":
+        factory = RowFactory(fields)
+        return factory.rows
+    if layout == "columns":
+        return lambda batch: [ColumnBatch.from_records(batch, fields)]
+    raise ValueError("layout should be one of 'dicts', 'rows' or 'columns'")
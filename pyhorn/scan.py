@@ -0,0 +1,257 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import heapq
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pyhorn.fields
+
+__all__ = ['scan']
+
+
+def scan(client,
+         entity,
+         where="id>0",
+         fields="id",
+         workers=4,
+         shard_by="id",
+         ordered=False,
+         page_size=200,
+         max_buffered=None):
+    """ Reads every record of `entity` matching `where` using `workers`
+        concurrent requests and yields them one by one.
+
+        With `shard_by="id"` the id range is cut into shards that are each
+        read in one request; a shard holding more records than a page is
+        split again over its remaining id range, so dense ranges are spread
+        across the pool instead of being read serially by one worker. With
+        `shard_by="offset"` the scan fans out `start`/`count` pages instead.
+
+        `ordered` yields records in shard order (by id, or by offset), at the
+        cost of holding finished shards until the ones before them are done.
+        At most `max_buffered` finished shards are held in memory.
+    """
+    if shard_by == "id":
+        planner = _IdShards(client, entity, where,
+                            pyhorn.fields.with_id(fields), page_size, workers)
+    elif shard_by == "offset":
+        planner = _OffsetShards(client, entity, where, fields, page_size,
+                                workers)
+    else:
+        raise ValueError("shard_by should be either 'id' or 'offset'")
+
+    runner = _ShardRunner(planner, workers, ordered, max_buffered
+                          or workers * 2)
+    yield from runner.run()
+
+
+class _IdShards:
+    def __init__(self, client, entity, where, fields, page_size, workers):
+        self.client = client
+        self.entity = entity
+        self.where = where
+        self.fields = fields
+        self.page_size = page_size
+        self.workers = workers
+
+    def plan(self):
+        first = self.client.query(self.entity,
+                                  self.where,
+                                  fields="id",
+                                  count=1,
+                                  sort="id",
+                                  showTotalMatched=True)
+        if not first.get("data"):
+            return []
+        last = self.client.query(self.entity,
+                                 self.where,
+                                 fields="id",
+                                 count=1,
+                                 sort="-id")
+        low, high = first["data"][0]["id"], last["data"][0]["id"] + 1
+        total = first.get("total")
+        pages = self.workers * 4 if total is None else math.ceil(
+            total / self.page_size)
+        return self.split(low, high, min(pages, self.workers * 4))
+
+    def split(self, low, high, parts):
+        parts = max(1, min(parts, high - low))
+        step = math.ceil((high - low) / parts)
+        return [(lo, min(lo + step, high)) for lo in range(low, high, step)]
+
+    def fetch(self, shard):
+        low, high = shard
+        response = self.client.query(
+            self.entity,
+            f"({self.where}) AND id >= {low} AND id < {high}",
+            fields=self.fields,
+            count=self.page_size,
+            sort="id",
+            showTotalMatched=True)
+        batch = response.get("data") or []
+        total = response.get("total")
+        if total is None:
+            # Without a total, only a full page says that records remain
+            more = len(batch) >= self.page_size
+            parts = self.workers * 2
+        else:
+            more = total > len(batch)
+            parts = math.ceil((total - len(batch)) / self.page_size)
+        if not batch or not more or batch[-1]["id"] + 1 >= high:
+            return batch, []
+        rest = self.split(batch[-1]["id"] + 1, high,
+                          min(parts, self.workers * 2))
+        return batch, rest
+
+
+class _OffsetShards:
+    """ Plans every page from the total of the first one. When the server
+        does not report a total, `workers` pages are read ahead and each full
+        page schedules the one `workers` pages further.
+    """
+    def __init__(self, client, entity, where, fields, page_size, workers):
+        self.client = client
+        self.entity = entity
+        self.where = where
+        self.fields = fields
+        self.page_size = page_size
+        self.workers = workers
+        self.first_page = None
+        self.stride = None
+
+    def query(self, start):
+        return self.client.query(self.entity,
+                                 self.where,
+                                 fields=self.fields,
+                                 count=self.page_size,
+                                 start=start,
+                                 showTotalMatched=True)
+
+    def plan(self):
+        self.first_page = self.query(0)
+        total = self.first_page.get("total")
+        if total is not None:
+            return [(start, ) for start in range(0, total, self.page_size)]
+        if len(self.first_page.get("data") or []) < self.page_size:
+            return [(0, )]
+        self.stride = self.workers * self.page_size
+        return [(start, ) for start in range(0, self.stride, self.page_size)]
+
+    def fetch(self, shard):
+        start, = shard
+        if start == 0 and self.first_page is not None:
+            response, self.first_page = self.first_page, None
+        else:
+            response = self.query(start)
+        batch = response.get("data") or []
+        if self.stride is not None and len(batch) >= self.page_size:
+            return batch, [(start + self.stride, )]
+        return batch, []
+
+
+class _ShardRunner:
+    """ Runs planned shards on a thread pool. Shards are keyed by their
+        starting position, which also gives the output order, and the pool
+        always picks the lowest pending shard so the head of the scan is never
+        starved by work further ahead.
+    """
+    def __init__(self, planner, workers, ordered, max_buffered):
+        self.planner = planner
+        self.workers = workers
+        self.ordered = ordered
+        self.max_buffered = max_buffered
+        self.lock = threading.Condition()
+        self.pending = []
+        self.running = set()
+        self.finished = {}
+        self.error = None
+        self.stopped = False
+
+    def head(self):
+        candidates = [*self.running, *self.finished]
+        if self.pending:
+            candidates.append(self.pending[0])
+        return min(candidates) if candidates else None
+
+    def work(self):
+        while True:
+            with self.lock:
+                while True:
+                    if self.stopped or self.error is not None:
+                        return
+                    if self.pending and (
+                            len(self.finished) < self.max_buffered
+                            or self.pending[0] == self.head()):
+                        shard = heapq.heappop(self.pending)
+                        self.running.add(shard)
+                        break
+                    if not self.pending and not self.running:
+                        return
+                    self.lock.wait()
+            try:
+                batch, rest = self.planner.fetch(shard)
+            except Exception as e:
+                with self.lock:
+                    self.error = e
+                    self.lock.notify_all()
+                return
+            with self.lock:
+                for part in rest:
+                    heapq.heappush(self.pending, part)
+                self.running.discard(shard)
+                self.finished[shard] = batch
+                self.lock.notify_all()
+
+    def take(self):
+        with self.lock:
+            while True:
+                if self.error is not None:
+                    raise self.error
+                if self.ordered:
+                    head = self.head()
+                    ready = head if head in self.finished else None
+                else:
+                    ready = next(iter(self.finished), None)
+                if ready is not None:
+                    self.lock.notify_all()
+                    return self.finished.pop(ready)
+                if not (self.pending or self.running or self.finished):
+                    return None
+                self.lock.wait()
+
+    def run(self):
+        self.pending = self.planner.plan()
+        heapq.heapify(self.pending)
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        for _ in range(self.workers):
+            executor.submit(self.work)
+        try:
+            while True:
+                batch = self.take()
+                if batch is None:
+                    return
+                yield from batch
+        finally:
+            with self.lock:
+                self.stopped = True
+                self.lock.notify_all()
+            executor.shutdown(wait=False)
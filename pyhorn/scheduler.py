@@ -0,0 +1,234 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import random
+import threading
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+__all__ = ['TokenBucket', 'AdaptiveLimiter', 'Scheduler', 'DeadlineExceeded']
+
+_throttle_statuses = [429, 503]
+_idempotent_retry_statuses = [500, 502, 504]
+_idempotent_methods = ["GET", "HEAD", "OPTIONS"]
+
+
+class DeadlineExceeded(requests.Timeout):
+    """ Raised when a request's deadline passes before it completes. """
+
+
+class TokenBucket:
+    """ Allows `rate` calls per second on average, with bursts of up to
+        `burst` calls.
+    """
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """ AIMD limit on concurrent requests.
+
+        The limit starts at `initial` (unbounded when None) and grows by one
+        for every `limit` successful requests. It is halved when the server
+        throttles, and shrinks by 10% when the smoothed latency exceeds
+        `latency_tolerance` times its slowly adapting baseline. Decreases are
+        applied at most once per `limit` completed requests, so one burst of
+        slow answers does not collapse the limit.
+    """
+    def __init__(self,
+                 initial=None,
+                 minimum=1,
+                 maximum=256,
+                 latency_tolerance=2.0):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.cooldown = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.limit is not None and self.in_flight >= int(
+                    self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, elapsed=None, throttled=False):
+        with self.condition:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            self.cooldown = max(0, self.cooldown - 1)
+            if throttled:
+                self.__decrease(0.5, in_flight)
+            elif elapsed is not None:
+                self.__observe(elapsed)
+            self.condition.notify_all()
+
+    def __decrease(self, factor, in_flight):
+        if self.cooldown:
+            return
+        current = self.limit if self.limit is not None else in_flight
+        self.limit = max(self.minimum, current * factor)
+        self.cooldown = int(self.limit) + in_flight
+
+    def __observe(self, elapsed):
+        if self.latency is None:
+            self.latency = self.baseline = elapsed
+        self.latency = 0.8 * self.latency + 0.2 * elapsed
+        self.baseline = min(self.latency,
+                            self.baseline + 0.01 * (elapsed - self.baseline))
+        if self.limit is None:
+            return
+        if self.latency > self.baseline * self.latency_tolerance:
+            self.__decrease(0.9, self.in_flight + 1)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+
+class Scheduler:
+    """ Paces the requests of a `RESTClient` to stay within the API limits.
+
+        Every request waits for a token of `rate` calls per second (when set)
+        and a slot of the `AdaptiveLimiter`. Throttling answers (429, 503) are
+        retried for any method, and 500/502/504 or connection errors only for
+        idempotent ones, with exponential backoff and jitter; a Retry-After
+        header takes precedence over the computed delay.
+    """
+    def __init__(self,
+                 rate: float = None,
+                 burst: int = None,
+                 limiter: AdaptiveLimiter = None,
+                 max_retries: int = 5,
+                 backoff: float = 0.5,
+                 max_backoff: float = 60):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limiter = limiter or AdaptiveLimiter()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt, response=None) -> float:
+        retry_after = response is not None and response.headers.get(
+            "Retry-After")
+        if retry_after:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                pass
+            try:
+                moment = parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                moment = None
+            if moment is not None:
+                if moment.tzinfo is None:
+                    moment = moment.replace(tzinfo=timezone.utc)
+                return min(self.max_backoff,
+                           max(0, moment.timestamp() - time.time()))
+        # Without a usable Retry-After, back off exponentially with jitter
+        ceiling = min(self.max_backoff, self.backoff * 2**attempt)
+        return random.uniform(ceiling / 2, ceiling)
+
+    def retryable(self, method, response=None, error=None) -> bool:
+        idempotent = method.upper() in _idempotent_methods
+        if error is not None:
+            return idempotent and isinstance(
+                error, (requests.ConnectionError, requests.Timeout))
+        if response.status_code in _throttle_statuses:
+            return True
+        return idempotent and \
+            response.status_code in _idempotent_retry_statuses
+
+    def send_once(self, send):
+        """ Calls `send()` once, paced like an attempt of `run` but never
+            retried; used for the extra copy of a hedged request.
+        """
+        if self.bucket is not None:
+            self.bucket.acquire()
+        self.limiter.acquire()
+        started = time.monotonic()
+        try:
+            response = send()
+        except Exception:
+            self.limiter.release()
+            raise
+        self.limiter.release(time.monotonic() - started,
+                             response.status_code in _throttle_statuses)
+        return response
+
+    def run(self, method, send, on_retry=None, deadline=None):
+        """ Calls `send()` until it returns a response that should not be
+            retried, or retries run out, and returns that response.
+
+            `deadline` is a `time.monotonic()` instant after which no attempt
+            is started; a retry whose backoff would end past it is given up,
+            returning the last response or raising the last error.
+        """
+        for attempt in range(self.max_retries + 1):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded("request deadline exceeded")
+            if self.bucket is not None:
+                self.bucket.acquire()
+            self.limiter.acquire()
+            response, started = None, time.monotonic()
+            try:
+                response = send()
+            except Exception as e:
+                self.limiter.release()
+                if attempt == self.max_retries or \
+                        not self.retryable(method, error=e):
+                    raise
+                error = e
+            else:
+                throttled = response.status_code in _throttle_statuses
+                self.limiter.release(time.monotonic() - started, throttled)
+                if attempt == self.max_retries or \
+                        not self.retryable(method, response):
+                    return response
+                error = None
+            delay = self.delay(attempt, response)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                if error is not None:
+                    raise error
+                return response
+            if on_retry is not None:
+                on_retry(response)
+            time.sleep(delay)
@@ -0,0 +1,138 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import AnyStr
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ['FileSessionStore', 'SQLiteSessionStore']
+
+
+class FileSessionStore:
+    """ Keeps the credentials in a JSON file shared by every process.
+
+        Writes go to a temporary file that atomically replaces the original,
+        and `lock` takes an advisory lock on `<file_name>.lock` so only one
+        process renews the session at a time. Where `fcntl` is not available
+        the lock only covers threads of the current process.
+    """
+    def __init__(self, file_name: AnyStr):
+        self.file_name = file_name
+        self.lock_name = f"{file_name}.lock"
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = None
+
+    @contextmanager
+    def lock(self):
+        with self.thread_lock:
+            if self.depth == 0 and fcntl is not None:
+                self.lock_file = open(self.lock_name, "a")
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+            self.depth += 1
+            try:
+                yield self
+            finally:
+                self.depth -= 1
+                if self.depth == 0 and self.lock_file is not None:
+                    fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+                    self.lock_file.close()
+                    self.lock_file = None
+
+    def load(self) -> dict:
+        try:
+            with open(self.file_name) as stream:
+                return json.load(stream)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, data: dict):
+        directory = os.path.dirname(os.path.abspath(self.file_name))
+        fd, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as stream:
+                json.dump(data, stream, indent=True)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(temp_name, self.file_name)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+
+
+class SQLiteSessionStore:
+    """ Keeps the credentials as a JSON document in a SQLite database, under
+        `key`. `lock` holds an immediate write transaction, which SQLite
+        serializes across processes.
+    """
+    def __init__(self, db_name: AnyStr, key: AnyStr = "default"):
+        self.db_name = db_name
+        self.key = key
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.connection = sqlite3.connect(db_name,
+                                          timeout=30,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sessions "
+                                "(key TEXT PRIMARY KEY, data TEXT)")
+
+    @contextmanager
+    def lock(self):
+        with self.thread_lock:
+            if self.depth == 0:
+                self.connection.execute("BEGIN IMMEDIATE")
+            self.depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.execute("ROLLBACK")
+                raise
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.execute("COMMIT")
+
+    def load(self) -> dict:
+        with self.thread_lock:
+            row = self.connection.execute(
+                "SELECT data FROM sessions WHERE key = ?",
+                (self.key, )).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save(self, data: dict):
+        with self.thread_lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?)",
+                (self.key, json.dumps(data)))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,182 @@
+# Copyright (c) 2019 FLOW Executive Finders
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import codecs
+import json
+import re
+
+__all__ = ['StreamedResponse']
+
+_structural = re.compile(r'["{}\[\]]')
+_string_end = re.compile(r'["\\]')
+_whitespace = re.compile(r'\s*')
+_scalar_end = re.compile(r'[\s,}\]]')
+
+
+class StreamedResponse:
+    """ Iterates over the records of a response's `data` array while the body
+        is still being downloaded, holding at most one record (plus one read
+        chunk) in memory.
+
+        Every other top-level key (`total`, `start`, `count`...) is kept in
+        `metadata`. Keys sent before `data` are available right away, keys
+        sent after it once iteration is over.
+    """
+    def __init__(self, response, chunk_size=64 * 1024, data_key="data"):
+        self.response = response
+        self.data_key = data_key
+        self.metadata = {}
+        self.__chunks = response.iter_content(chunk_size)
+        self.__decoder = codecs.getincrementaldecoder(response.encoding
+                                                      or "utf-8")()
+        self.__json = json.JSONDecoder()
+        self.__buffer = ""
+        self.__eof = False
+        self.__records = self.__parse()
+        next(self.__records, None)
+
+    @property
+    def total(self):
+        return self.metadata.get("total")
+
+    @property
+    def start(self):
+        return self.metadata.get("start")
+
+    @property
+    def count(self):
+        return self.metadata.get("count")
+
+    def __iter__(self):
+        return self.__records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.__records.close()
+        self.response.close()
+
+    def __fill(self) -> bool:
+        if self.__eof:
+            return False
+        for chunk in self.__chunks:
+            text = self.__decoder.decode(chunk)
+            if text:
+                self.__buffer += text
+                return True
+        self.__buffer += self.__decoder.decode(b"", final=True)
+        self.__eof = True
+        return False
+
+    def __peek(self) -> str:
+        """ Skips whitespace and returns the next character, or '' at EOF.
+        """
+        while True:
+            end = _whitespace.match(self.__buffer).end()
+            self.__buffer = self.__buffer[end:]
+            if self.__buffer:
+                return self.__buffer[0]
+            if not self.__fill():
+                return ""
+
+    def __expect(self, char):
+        if self.__peek() != char:
+            raise ValueError(f"Expected {char!r} in streamed JSON response, "
+                             f"got {self.__buffer[:20]!r}")
+        self.__buffer = self.__buffer[1:]
+
+    def __value_end(self) -> int:
+        """ Index just past the JSON value at the start of the buffer,
+            reading more of the body until the whole value is buffered.
+        """
+        position, depth, in_string = 0, 0, False
+        scalar = self.__buffer[0] not in '{["'
+        while True:
+            buffer = self.__buffer
+            if scalar:
+                match = _scalar_end.search(buffer)
+                if match is not None:
+                    return match.start()
+            while not scalar and position < len(buffer):
+                if in_string:
+                    match = _string_end.search(buffer, position)
+                    if match is None:
+                        position = len(buffer)
+                    elif match.group() == "\\":
+                        if match.end() == len(buffer):
+                            break
+                        position = match.end() + 1
+                    else:
+                        position, in_string = match.end(), False
+                        if depth == 0:
+                            return position
+                    continue
+                match = _structural.search(buffer, position)
+                if match is None:
+                    position = len(buffer)
+                    continue
+                char, position = match.group(), match.end()
+                if char == '"':
+                    in_string = True
+                elif char in "{[":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return position
+            if not self.__fill():
+                if scalar:
+                    return len(self.__buffer)
+                raise ValueError("Truncated streamed JSON response")
+
+    def __value(self):
+        self.__peek()
+        end = self.__value_end()
+        value, _ = self.__json.raw_decode(self.__buffer[:end])
+        self.__buffer = self.__buffer[end:]
+        return value
+
+    def __parse(self):
+        self.__expect("{")
+        if self.__peek() == "}":
+            return
+        while True:
+            key = self.__value()
+            self.__expect(":")
+            if key == self.data_key and self.__peek() == "[":
+                self.__buffer = self.__buffer[1:]
+                yield None
+                if self.__peek() != "]":
+                    while True:
+                        yield self.__value()
+                        if self.__peek() != ",":
+                            break
+                        self.__buffer = self.__buffer[1:]
+                self.__expect("]")
+            else:
+                self.metadata[key] = self.__value()
+            if self.__peek() != ",":
+                break
+            self.__buffer = self.__buffer[1:]
+        self.__expect("}")
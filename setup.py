@@ -15,6 +15,15 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/flowef/pyhorn/",
     packages=setuptools.find_packages(),
+    python_requires=">=3.9",
+    install_requires=["requests"],
+    extras_require={
+        "async": ["aiohttp"],
+        "fast": ["orjson"],
+    },
+    entry_points={
+        "console_scripts": ["pyhorn=pyhorn.cli:main"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",